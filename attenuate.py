@@ -1,6 +1,8 @@
 import numpy as np
 import math
+from ct_memory import instrument
 
+@instrument('attenuate')
 def attenuate(original_energy, coeff, depth):
 	"""calculates residual photons for a particular material and depth
 	attenuate(original_energy, coeff, depth, mas) takes the original_energy
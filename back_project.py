@@ -3,23 +3,117 @@ import math
 import scipy
 from scipy import interpolate
 import sys
+from ct_kernels import get_backend, back_project_add
+from ramp_filter import ramp_filter_response
+from ct_memory import instrument
 
-def back_project(sinogram, skip=1):
+@instrument('back_project')
+def back_project(sinogram, skip=1, centre=None, pixel=None, shape=None, coordinates=None, method='direct', accuracy=4, out=None):
 
 	"""back_project back-projection to reconstruct CT data
 	back_project(sinogram) back-projects the filtered sinogram
 	(angles x samples) to create the reconstruted data (samples x
-	samples)"""
+	samples)
+
+	back_project(sinogram, centre=(x, y), pixel=p, shape=(rows, cols))
+	reconstructs only a region of interest, of the given shape, with pixels
+	of size p samples (so p < 1 zooms in), centred on (x, y). Positions are in
+	the pixels of the full reconstruction, with x along the columns and y along
+	the rows. centre defaults to the middle of the full image, pixel to 1 and
+	shape to enough pixels to cover the full image.
+
+	back_project(sinogram, coordinates=(x, y)) reconstructs the values at the
+	arbitrary positions given in the arrays x and y, and the output has their shape.
+
+	A stack of filtered sinograms (slices x angles x samples) is reconstructed
+	all at once, into (slices x samples x samples), with the coordinates for
+	each angle formed once for every slice.
+
+	The cost scales with the number of pixels reconstructed. Pixels outside the
+	reconstructed circle are set to -1. As the output no longer covers the full
+	image, Hounsfield Units for a region should be found with hu_calibration
+	for the full size samples, and hu_stored.
+
+	When the ct_kernels backend is numba, each angle is added by its compiled
+	kernel instead.
+
+	back_project(sinogram, method='hierarchical', accuracy=a) reconstructs the
+	full image with back_project_hierarchical instead, which is much faster for
+	large images, but approximate, with accuracy a as described there.
+
+	sinogram can also be a ChunkedArray from ct_lib, which is read once.
+
+	If out is given, such as a ChunkedArray from ct_lib of the size of the
+	output, the reconstruction is written into it a block of rows (or for a
+	stack, a slice) at a time, so only that block is held in memory, and out
+	is returned. Blocks are the chunks of out if it has them."""
+
+	if method == 'hierarchical':
+		if skip != 1 or centre is not None or pixel is not None or shape is not None or coordinates is not None:
+			raise ValueError('hierarchical back-projection only reconstructs the full image')
+		if out is not None:
+			out[...] = back_project_hierarchical(sinogram, accuracy)
+			return out
+		return back_project_hierarchical(sinogram, accuracy)
+	elif method != 'direct':
+		raise ValueError('unknown back-projection method ' + str(method))
+
+	# read a stored sinogram once, rather than for every angle
+	sinogram = np.asarray(sinogram)
 
 	# get input dimensions
-	ns = sinogram.shape[1]
-	angles = sinogram.shape[0]
-	n = int(math.floor((ns-1) // skip) + 1)
+	ns = sinogram.shape[-1]
+	angles = sinogram.shape[-2]
+	slices = sinogram.shape[:-2]
 
-	# zero output and form input coordinates
+	# form input coordinates, as views of the rows and columns for a grid
 	# these have centre in the middle of the image
-	reconstruction = np.zeros((n, n))
-	xi, yi = np.meshgrid(np.arange(0,ns,skip) - (ns/2) + 0.5, np.arange(0,ns,skip) - (ns/2) + 0.5)
+	if coordinates is not None:
+		xi = np.asarray(coordinates[0], dtype=float) - (ns/2) + 0.5
+		yi = np.asarray(coordinates[1], dtype=float) - (ns/2) + 0.5
+	elif centre is not None or pixel is not None or shape is not None:
+		if centre is None:
+			centre = ((ns - 1) / 2, (ns - 1) / 2)
+		if pixel is None:
+			pixel = 1
+		if shape is None:
+			shape = (int(math.ceil(ns / pixel)), int(math.ceil(ns / pixel)))
+		xi, yi = np.meshgrid((np.arange(shape[1]) - (shape[1] - 1) / 2) * pixel + centre[0] - (ns/2) + 0.5,
+			(np.arange(shape[0]) - (shape[0] - 1) / 2) * pixel + centre[1] - (ns/2) + 0.5, sparse=True)
+	else:
+		xi, yi = np.meshgrid(np.arange(0,ns,skip) - (ns/2) + 0.5, np.arange(0,ns,skip) - (ns/2) + 0.5, sparse=True)
+	xi, yi = np.broadcast_arrays(xi, yi)
+
+	if out is None:
+		reconstruction = _back_project_points(sinogram, np.array(xi), np.array(yi))
+		sys.stdout.write("\n")
+		return reconstruction
+
+	if len(slices) > 0:
+		# write each slice in turn
+		for index in np.ndindex(slices):
+			out[index] = _back_project_points(sinogram[index], np.array(xi), np.array(yi))
+	else:
+		# write blocks of rows, of the chunks of out or of about 4MB
+		chunks = getattr(out, 'chunks', None)
+		if isinstance(chunks, tuple) and len(chunks) > 0:
+			block = chunks[0]
+		else:
+			block = max(1, 2 ** 19 // max(int(np.prod(xi.shape[1:])), 1))
+		for start in range(0, max(len(xi), 1), block):
+			out[start:start + block] = _back_project_points(sinogram, np.array(xi[start:start + block]), np.array(yi[start:start + block]))
+	sys.stdout.write("\n")
+
+	return out
+
+def _back_project_points(sinogram, xi, yi):
+	"""back projection of the filtered sinogram (... x angles x samples) at the
+	points (xi, yi), relative to the middle of the image, as in back_project"""
+
+	ns = sinogram.shape[-1]
+	angles = sinogram.shape[-2]
+	slices = sinogram.shape[:-2]
+	reconstruction = np.zeros(slices + xi.shape)
 
 	# back project over each angle in turn
 	for angle in range(angles):
@@ -29,6 +123,10 @@ def back_project(sinogram, skip=1):
 		# the rotation is about the middle of the image,
 		# but the output coordinates need to be relative to the top left
 		p = math.pi / 2 + angle * math.pi / angles
+		if get_backend() == 'numba':
+			# the compiled kernel fuses the steps below in one pass
+			back_project_add(reconstruction, sinogram[..., angle, :], xi, yi, p, math.pi / angles)
+			continue
 		x0 = xi * math.cos(p) - yi * math.sin(p) + (ns / 2) - 0.5
 		
 		# interpolate and add this data to output
@@ -36,12 +134,290 @@ def back_project(sinogram, skip=1):
 		# Either of the following options will work
 		# x2 = scipy.interpolate.interp1d(np.arange(0, ns, 1), sinogram[angle], kind='linear', copy=False, assume_sorted=True, bounds_error=False, fill_value=0, axis=0)
 		# reconstruction = reconstruction + x2(x0) * (math.pi / angles)
-		x2 = scipy.ndimage.map_coordinates(sinogram[angle], [x0], order=1, mode='constant', cval=0, prefilter=False)
+		if len(slices) == 0:
+			x2 = scipy.ndimage.map_coordinates(sinogram[angle], [x0], order=1, mode='constant', cval=0, prefilter=False)
+		else:
+			x2 = interpolate_samples(sinogram[..., angle, :], x0)
 		reconstruction = reconstruction + x2 * (math.pi / angles)
 
 	# ensure any data outside the reconstructed circle is set to invalid
-	reconstruction[np.where((xi ** 2 + yi ** 2) > (ns/2)**2)] = -1
+	reconstruction[..., (xi ** 2 + yi ** 2) > (ns/2)**2] = -1
+
+	return reconstruction
+
+def interpolate_samples(rows, x):
+
+	"""linearly interpolate each row of rows (... x samples) at the sample
+	positions x, giving (... x x.shape), with zero outside the samples as for
+	map_coordinates with mode 'constant'. The taps and weights are found once
+	for all the rows."""
+
+	ns = rows.shape[-1]
+	low = np.clip(np.floor(x).astype(int), 0, max(ns - 2, 0))
+	fraction = x - low
+	valid = (x >= 0) & (x <= ns - 1)
+
+	high = np.minimum(low + 1, ns - 1)
+	values = rows[..., low] * (1 - fraction) + rows[..., high] * fraction
+
+	return np.where(valid, values, 0)
+
+def back_project_progressive(sinogram, levels=4):
+
+	"""back_project_progressive progressive back-projection preview
+	for reconstruction in back_project_progressive(sinogram) yields successively
+	finer reconstructions of the filtered sinogram (angles x samples). The first
+	uses every 2^(levels-1)th pixel and angle, the same size as
+	back_project(sinogram, skip), and each following one halves both steps, until
+	the last is the full reconstruction from back_project(sinogram).
+
+	The coarse pixels and angles are a subset of the finer ones, and each
+	pixel and angle pair is only interpolated once, so the total cost is the
+	same as a single full reconstruction."""
+
+	# get input dimensions
+	ns = sinogram.shape[1]
+	angles = sinogram.shape[0]
+
+	# form full resolution input coordinates, and the sum over angles so far
+	xi, yi = np.meshgrid(np.arange(ns) - (ns/2) + 0.5, np.arange(ns) - (ns/2) + 0.5)
+	accumulated = np.zeros((ns, ns))
+	done_pixels = np.zeros((ns, ns), dtype=bool)
+	done_angles = np.zeros(angles, dtype=bool)
+
+	for level in range(levels - 1, -1, -1):
+		step = 2 ** level
+		sys.stdout.write("Reconstructing level: %d   \r" % (levels - level) )
+
+		# pixels and angles used at this level
+		pixels = np.zeros((ns, ns), dtype=bool)
+		pixels[::step, ::step] = True
+		level_angles = np.zeros(angles, dtype=bool)
+		level_angles[::step] = True
+
+		# new pixels need all of this level's angles, and existing pixels only
+		# need the new angles
+		new_pixels = np.nonzero(pixels & ~done_pixels)
+		old_pixels = np.nonzero(done_pixels)
+		for pixel_index, angle_set in ((new_pixels, level_angles), (old_pixels, level_angles & ~done_angles)):
+			x, y = xi[pixel_index], yi[pixel_index]
+			for angle in np.flatnonzero(angle_set):
+				p = math.pi / 2 + angle * math.pi / angles
+				x0 = x * math.cos(p) - y * math.sin(p) + (ns / 2) - 0.5
+				accumulated[pixel_index] += scipy.ndimage.map_coordinates(sinogram[angle], [x0], order=1, mode='constant', cval=0, prefilter=False)
+
+		done_pixels = pixels
+		done_angles = level_angles
+
+		# scale by the angle step, and set data outside the circle to invalid
+		reconstruction = accumulated[::step, ::step] * (math.pi / np.sum(level_angles))
+		reconstruction[np.where((xi[::step, ::step] ** 2 + yi[::step, ::step] ** 2) > (ns/2)**2)] = -1
+
+		yield reconstruction
+
+	sys.stdout.write("\n")
+
+@instrument('back_project_hierarchical')
+def back_project_hierarchical(sinogram, accuracy=4, leaf=16, oversample=2):
+
+	"""back_project_hierarchical fast hierarchical back-projection
+	back_project_hierarchical(sinogram) back-projects the filtered sinogram
+	(angles x samples), or a stack of them (slices x angles x samples), to
+	give nearly the same output as back_project(sinogram), at a cost of order
+	samples^2 log(samples) rather than angles x samples^2.
+
+	The image is split recursively into four sub-images. Each sub-image gets
+	its own sinogram, holding only the samples of rays which pass through it,
+	measured from its centre, and as a sub-image is half the size, pairs of
+	neighbouring angles can be merged into one with little loss of accuracy.
+	Sub-images of leaf pixels or fewer are then back-projected exactly from
+	their own sinograms, using the merged angles.
+
+	Angles are only merged once the ray position error this causes anywhere
+	in the sub-image is below 1/accuracy samples, so a larger accuracy is
+	slower and closer to back_project, and a very large one merges nothing.
+	The samples are interpolated to oversample times finer spacing first,
+	which reduces the blurring from merging angles, at the cost of time and
+	memory. Sub-images are worked through depth first once their sinograms
+	become large, so memory use stays bounded.
+
+	The gain grows with the image size. With the default accuracy, for an
+	n x n image from n angles on one CPU, check_hierarchical in ct_checks.py
+	measured it 1.4x faster than back_project at n = 256, 2.3x at 512, 4.5x
+	at 1024 and 11x at 2048, with an RMS difference of 0.4-0.7% of the image."""
+
+	# get input dimensions, with any stack flattened into one axis
+	ns = sinogram.shape[-1]
+	angles = sinogram.shape[-2]
+	slices = sinogram.shape[:-2]
+	data = np.asarray(sinogram, dtype=float).reshape((-1, angles, ns))
+	stack = data.shape[0]
+
+	# pad the image up to a whole number of equal sized leaves
+	levels = max(int(math.ceil(math.log2(ns / leaf))), 0)
+	size = int(math.ceil(ns / 2 ** levels))
+	n = size * 2 ** levels
+	pad = (n - ns) // 2
+	centre = (n - 1) / 2 - pad - (ns/2) + 0.5
+
+	# interpolate each row to spacing 1 / oversample, and hold it with the
+	# position of its first sample from the centre of its image region
+	h = 1 / oversample
+	k = np.arange((ns - 1) * oversample + 1) * h
+	low = np.minimum(np.floor(k).astype(int), max(ns - 2, 0))
+	fraction = k - low
+	data = data[..., low] * (1 - fraction) + data[..., np.minimum(low + 1, ns - 1)] * fraction
+
+	p = math.pi / 2 + np.arange(angles) * math.pi / angles
+	origin = -((ns/2) - 0.5) - centre * (np.cos(p) - np.sin(p))
+
+	reconstruction = np.zeros((stack, 2 ** levels, size, 2 ** levels, size))
+	_hierarchical(data[None], origin[None], p, np.ones(angles), np.zeros((1, 2), dtype=int), 0, levels, size, h, accuracy, reconstruction)
+
+	# scale by the angle step, and cut out the image from the padding
+	reconstruction = reconstruction.reshape((stack, n, n))[:, pad:pad + ns, pad:pad + ns] * (math.pi / angles)
+
+	# ensure any data outside the reconstructed circle is set to invalid
+	xi, yi = np.meshgrid(np.arange(ns) - (ns/2) + 0.5, np.arange(ns) - (ns/2) + 0.5)
+	reconstruction[..., (xi ** 2 + yi ** 2) > (ns/2)**2] = -1
 
 	sys.stdout.write("\n")
 
-	return reconstruction
\ No newline at end of file
+	return reconstruction.reshape(slices + (ns, ns))
+
+def _hierarchical(data, origin, p, count, block, level, levels, size, h, accuracy, reconstruction):
+
+	"""one level of back_project_hierarchical for a batch of image regions, with
+	sinograms data (regions x slices x angles x samples) whose first samples are
+	at origin (regions x angles) from the region centres, at angles p made up of
+	count original angles. block holds the (row, col) of each region at this
+	level, and the leaves are added into reconstruction."""
+
+	if level == levels:
+		_hierarchical_leaves(data, origin, p, block, size, h, reconstruction)
+		return
+
+	sys.stdout.write("Reconstructing level: %d   \r" % (level + 1) )
+
+	# size of the sub-images, and the furthest any of their rays are from the centre
+	child = size * 2 ** (levels - level - 1)
+	radius = math.sqrt(2) * (child - 1) / 2 + 2
+	samples = int(math.ceil(2 * radius / h)) + 2
+
+	# work through the sub-images one at a time if they would use much memory
+	offsets = [(dy, dx) for dy in (-1, 1) for dx in (-1, 1)]
+	if data[..., :samples].size * 4 * 8 > 2 ** 28:
+		batches = [[offset] for offset in offsets]
+	else:
+		batches = [offsets]
+
+	merge = len(p) > 1 and radius * math.pi / (2 * ((len(p) + 1) // 2)) <= 1 / accuracy
+
+	for batch in batches:
+		# cut out the rays through each sub-image, with whole sample shifts only
+		# so nothing is interpolated, and any fraction is kept in the origin
+		child_data, child_origin = [], []
+		for dy, dx in batch:
+			shift = (dx * np.cos(p) - dy * np.sin(p)) * child / 2
+			first = np.floor((-radius + shift - origin) / h).astype(int)
+			index = first[:, :, None] + np.arange(samples)
+			valid = (index >= 0) & (index < data.shape[-1])
+			index = np.clip(index, 0, data.shape[-1] - 1)
+			child_data.append(np.where(valid[:, None], np.take_along_axis(data, index[:, None], axis=-1), 0))
+			child_origin.append(origin + first * h - shift)
+		child_data = np.concatenate(child_data)
+		child_origin = np.concatenate(child_origin)
+		child_block = np.concatenate([block * 2 + [(dy + 1) // 2, (dx + 1) // 2] for dy, dx in batch])
+		child_p, child_count = p, count
+
+		if merge:
+			pairs = len(p) // 2
+			even, odd, last = slice(0, 2 * pairs, 2), slice(1, 2 * pairs, 2), slice(2 * pairs, len(p))
+
+			# shift each odd row onto the samples of the even row before it
+			shift = (child_origin[:, even] - child_origin[:, odd]) / h
+			whole = np.floor(shift).astype(int)
+			fraction = (shift - whole)[:, None, :, None]
+			index = whole[:, :, None] + np.arange(samples)
+			rows = child_data[:, :, odd]
+			odd_data = np.zeros(rows.shape)
+			for tap, weight in ((index, 1 - fraction), (index + 1, fraction)):
+				valid = (tap >= 0) & (tap < samples)
+				odd_data += np.where(valid[:, None], np.take_along_axis(rows, np.clip(tap, 0, samples - 1)[:, None], axis=-1), 0) * weight
+
+			# each merged angle is the mean of the original angles it holds
+			total = count[even] + count[odd]
+			child_data = np.concatenate((child_data[:, :, even] + odd_data, child_data[:, :, last]), axis=2)
+			child_origin = np.concatenate((child_origin[:, even], child_origin[:, last]), axis=1)
+			child_p = np.concatenate(((p[even] * count[even] + p[odd] * count[odd]) / total, p[last]))
+			child_count = np.concatenate((total, count[last]))
+
+		_hierarchical(child_data, child_origin, child_p, child_count, child_block, level + 1, levels, size, h, accuracy, reconstruction)
+
+def _hierarchical_leaves(data, origin, p, block, size, h, reconstruction):
+
+	"""exact back-projection of each leaf region of back_project_hierarchical
+	from its own sinogram, added into its block of reconstruction"""
+
+	xl, yl = np.meshgrid(np.arange(size) - (size - 1) / 2, np.arange(size) - (size - 1) / 2)
+	leaves = np.zeros((len(block), data.shape[1], size, size))
+	regions = np.arange(len(block))[:, None, None]
+	for angle in range(len(p)):
+		x0 = ((xl * math.cos(p[angle]) - yl * math.sin(p[angle]))[None] - origin[:, angle, None, None]) / h
+		low = np.floor(x0).astype(int)
+		fraction = x0 - low
+		rows = data[:, :, angle]
+		for tap, weight in ((low, 1 - fraction), (low + 1, fraction)):
+			valid = (tap >= 0) & (tap < rows.shape[-1])
+			tap = np.clip(tap, 0, rows.shape[-1] - 1)
+			leaves += np.where(valid[:, None], rows[regions, :, tap].transpose(0, 3, 1, 2), 0) * weight[:, None]
+
+	reconstruction[:, block[:, 0], :, block[:, 1], :] += leaves
+
+class BackProjector(object):
+	def __init__(self, samples, angles, scale, alpha=0.001, slices=()):
+		"""BackProjector reconstructs a parallel-beam scan one projection at a
+		time, as the projections arrive, such as for a preview during a scan.
+		Each projection (samples), or stack of projections (slices x samples),
+		of calibrated attenuation at one of angles angles is given to add(), in
+		any order, and is ramp filtered as for ramp_filter(sinogram, scale,
+		alpha) and back-projected straight away. image() returns the
+		reconstruction so far at any time.
+
+		Only the reconstruction (slices x samples x samples) is held, with the
+		projection being added, so memory does not grow with the angles. Once
+		every angle has been added once, image() is the same as
+		back_project(ramp_filter(sinogram, scale, alpha))."""
+
+		self.samples = samples
+		self.angles = angles
+		self.slices = tuple(slices)
+		self.count = 0
+		self.m, self.q = ramp_filter_response(samples, scale, alpha)
+		self.xi, self.yi = np.meshgrid(np.arange(samples) - (samples/2) + 0.5, np.arange(samples) - (samples/2) + 0.5)
+		self.reconstruction = np.zeros(self.slices + (samples, samples))
+
+	def add(self, angle, projection):
+		"""ramp filter and back-project the projection (samples), or stack of
+		projections (slices x samples), at angle number angle"""
+
+		projection = np.asarray(projection, dtype=float)
+		if projection.shape != self.slices + (self.samples,):
+			raise ValueError('projection has a different size to the reconstruction')
+
+		filtered = np.fft.irfft(np.fft.rfft(projection, self.m, axis=-1) * self.q, axis=-1)[..., :self.samples]
+
+		p = math.pi / 2 + angle * math.pi / self.angles
+		back_project_add(self.reconstruction, filtered, self.xi, self.yi, p, 1.0)
+		self.count = self.count + 1
+
+	def image(self):
+		"""the reconstruction from the projections added so far, weighted by the
+		number of them, so it is on the same scale as the full reconstruction"""
+
+		reconstruction = self.reconstruction * (math.pi / max(self.count, 1))
+
+		# ensure any data outside the reconstructed circle is set to invalid
+		reconstruction[..., (self.xi ** 2 + self.yi ** 2) > (self.samples/2)**2] = -1
+
+		return reconstruction
@@ -1,11 +1,17 @@
+import concurrent.futures
 import datetime
+import glob
+import multiprocessing
+import time as timer
 import pydicom
 from pydicom.dataset import Dataset, FileDataset
 import numpy as np
 import os
+from ct_memory import instrument
 
 
-def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None, frame_uid=None, time=datetime.datetime.now(), storage_directory=None):
+@instrument('create_dicom')
+def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None, frame_uid=None, time=datetime.datetime.now(), storage_directory=None, stored=False, compress=False):
 
 	""" Create DICOM format output file from data
 
@@ -25,6 +31,14 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 	using the DICOMUID function. The time can be generated using datetime.datetime.now().
 
 	optional storage_directory parameter can set the file's storage directory path
+
+	optional stored parameter indicates that x already holds uint16 stored values
+	(HU + 1024), for example from hu_stored, which are then written unchanged
+
+	optional compress parameter writes the pixel data with the lossless RLE
+	transfer syntax, which is much smaller for the uniform background outside
+	the reconstructed circle, but is slower to write. DicomWriter can do this
+	on several background processes.
 	"""
 
 	# check for inputs
@@ -41,10 +55,12 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 		frame_uid = pydicom.uid.generate_uid()
 
 
-	# get data with the appropriate limits
-	x = x + 1024
-	x = np.clip(x, 0, None)
-	x = np.clip(x, None, 4096)
+	# get data with the appropriate limits, 0 to 4095 for the 12 bits of HU
+	# from -1024 to 3071, the same as hu and hu_stored
+	if not stored:
+		x = np.clip(x + 1024, 0, 4095).astype(np.uint16)
+	elif x.dtype != np.uint16:
+		raise ValueError('stored input x must be uint16')
 
 	# Initial write to create DICOM file with default settings
 	full_filename = filename + '_' + str(f).zfill(4) + '.dcm'
@@ -103,11 +119,132 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 	ds.Columns = x.shape[1]
 	ds.Rows = x.shape[0]
 
-	if x.dtype != np.uint16:
-		x = x.astype(np.uint16)
-
-	ds.PixelData = x.tostring()
+	if compress:
+		ds.compress(pydicom.uid.RLELossless, np.ascontiguousarray(x), generate_instance_uid=False)
+	else:
+		ds.PixelData = x.tobytes()
 
 	# write final file with this metadata
 	ds.save_as(full_filename, write_like_original=False)
-	
\ No newline at end of file
+
+
+def create_dicom_series(volume, filename, sp, sz=None, study_uid=None, series_uid=None, frame_uid=None, time=None, storage_directory=None, first=1):
+
+	""" Create a DICOM series from a volume of slices
+
+	create_dicom_series(volume, filename, sp, sz) writes each slice of volume
+	(slices x rows x cols) as frames first, first + 1, ... of one DICOM series,
+	as create_dicom(volume[i], filename, sp, sz, first + i) would. volume can be
+	a memory-mapped array, such as from open_volume, as only one slice is read
+	at a time. uint16 volumes are taken to hold stored values (HU + 1024), as
+	from hu_stored, and other volumes to hold Hounsfield Units.
+
+	The study, series and frame UIDs and time are generated if not given, and
+	are returned so that later frames can be added to the same series.
+	"""
+
+	if study_uid is None:
+		study_uid = pydicom.uid.generate_uid()
+
+	if series_uid is None:
+		series_uid = pydicom.uid.generate_uid()
+
+	if frame_uid is None:
+		frame_uid = pydicom.uid.generate_uid()
+
+	if time is None:
+		time = datetime.datetime.now()
+
+	stored = volume.dtype == np.uint16
+	for index in range(volume.shape[0]):
+		create_dicom(np.asarray(volume[index]), filename, sp, sz, first + index, study_uid, series_uid, frame_uid, time, storage_directory, stored)
+
+	return study_uid, series_uid, frame_uid, time
+
+class DicomWriter(object):
+	def __init__(self, workers=1, compress=False, pending=None):
+		"""DicomWriter writes DICOM frames with create_dicom on a pool of workers
+		background processes, so that the caller can carry on with the next
+		reconstruction while frames are encoded and written. If compress is
+		True, frames are written with the lossless RLE transfer syntax. At most
+		pending frames (default twice the workers) are held waiting to be
+		written, after which write waits for one to finish. close() waits for
+		all frames to be written, and raises any error from the workers.
+
+		The workers are started with spawn rather than fork, as forking after
+		the numba kernels of ct_kernels have started their threads leaves the
+		interpreter unable to exit.
+
+		spawn starts each worker by importing the caller's main script again,
+		so a script which uses a DicomWriter must keep its work under
+		if __name__ == '__main__':, or every worker repeats the work before it
+		can write anything. Scripts such as ct_test_example.py, which run their
+		work when imported, should write directly with create_dicom instead.
+
+		with DicomWriter(workers=4, compress=True) as writer:
+			writer.write(stored, 'frame', 0.1, 0.1, z, study_uid, series_uid, frame_uid, time, stored=True)"""
+
+		self.compress = compress
+		self.pending = pending if pending is not None else 2 * workers
+		self._pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+		self._futures = set()
+
+	def write(self, x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None, frame_uid=None, time=None, storage_directory=None, stored=False):
+		"""queue a frame to be written, with the same arguments as create_dicom"""
+
+		if time is None:
+			time = datetime.datetime.now()
+
+		# wait for space in the queue, raising any error so far
+		if len(self._futures) >= self.pending:
+			done, self._futures = concurrent.futures.wait(self._futures, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				future.result()
+
+		self._futures.add(self._pool.submit(create_dicom, np.array(x), filename, sp, sz, f, study_uid, series_uid, frame_uid, time, storage_directory, stored, self.compress))
+
+	def close(self):
+		"""wait for all queued frames to be written"""
+
+		try:
+			for future in concurrent.futures.as_completed(self._futures):
+				future.result()
+		finally:
+			self._futures = set()
+			self._pool.shutdown()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def dicom_benchmark(volume, storage_directory, workers=1):
+
+	""" Compare uncompressed and compressed DICOM output
+
+	results = dicom_benchmark(volume, storage_directory, workers) writes the
+	uint16 stored values in volume (slices x rows x cols), such as from
+	reconstruct_volume or hu_stored, as a DICOM series into storage_directory,
+	once uncompressed and once with RLE compression, both through a
+	DicomWriter with workers processes. results is a dictionary holding, for
+	'uncompressed' and 'rle', the total 'bytes' written and the end-to-end
+	'time' in seconds, and the 'ratio' of compressed to uncompressed bytes.
+	"""
+
+	if not os.path.exists(storage_directory):
+		os.makedirs(storage_directory)
+
+	results = {}
+	for name, compress in (('uncompressed', False), ('rle', True)):
+		start = timer.perf_counter()
+		with DicomWriter(workers, compress) as writer:
+			for index in range(volume.shape[0]):
+				writer.write(np.asarray(volume[index]), name, 0.1, 0.1, index + 1, storage_directory=storage_directory, stored=True)
+		elapsed = timer.perf_counter() - start
+		files = glob.glob(os.path.join(storage_directory, name + '_*.dcm'))
+		results[name] = {'bytes': sum(os.path.getsize(f) for f in files), 'time': elapsed}
+
+	results['ratio'] = results['rle']['bytes'] / results['uncompressed']['bytes']
+
+	return results
@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy
+from scipy import ndimage
+import ct_kernels
+import ct_memory
+from ct_metrics import mtf, mtf50
+from ramp_filter import ramp_filter
+from back_project import back_project, back_project_hierarchical
+from create_dicom import DicomWriter, dicom_benchmark
+
+# python ct_checks.py [name ...] runs the named checks (default all of them),
+# printing what each found, and fails if any of them does not pass. Each check
+# raises ValueError if it does not pass, so they can also be called on their own,
+# with arguments, such as check_dicom_writer('scan.rsq') or
+# check_memory('thresholds.json', 256).
+
+def check_mtf(n=256, scale=0.01, sigmas=(1, 2, 3), tolerance=0.02):
+	"""check mtf and mtf50 against images of Gaussian point spread functions,
+	for each standard deviation in sigmas (in pixels), whose MTF falls to half
+	at sqrt(ln(2) / 2) / (pi sigma) cycles per pixel. All the images are
+	measured together as a stack. Returns the measured and expected MTF50 in
+	cycles/cm for each sigma."""
+
+	impulse = np.zeros((n, n))
+	impulse[n - 1 - n // 2, n // 2] = 1
+	images = np.stack([scipy.ndimage.gaussian_filter(impulse, sigma) for sigma in sigmas])
+
+	f, m = mtf(images, scale)
+	if np.any(m > 1):
+		raise ValueError('MTF exceeds 1')
+	measured = mtf50(f, m)
+
+	results = {}
+	for sigma, f50 in zip(sigmas, measured):
+		expected = math.sqrt(math.log(2) / 2) / (math.pi * sigma) / scale
+		results[sigma] = (float(f50), expected)
+		if not abs(f50 - expected) <= tolerance * expected:
+			raise ValueError('MTF50 of Gaussian with sigma %g is %g cycles/cm, not %g' % (sigma, f50, expected))
+
+	return results
+
+def check_hierarchical(n=512, accuracy=4, tolerance=0.01):
+	"""time back_project_hierarchical at the given accuracy against back_project,
+	for an n x n image from n angles, and check that the RMS difference between
+	them, inside the reconstruction circle, is below tolerance of the RMS of
+	back_project. The sinogram is of a few discs of different sizes and
+	attenuation, ramp filtered. Returns the times in seconds of back_project and
+	back_project_hierarchical, the speed-up and the relative RMS difference."""
+
+	# projections of each disc (x, y, radius, attenuation), in pixels from the centre
+	discs = [(0, 0, 0.45 * n, 1), (0.1 * n, -0.15 * n, 0.1 * n, 0.5), (-0.2 * n, 0.05 * n, 0.05 * n, 2),
+		(0.05 * n, 0.25 * n, 0.02 * n, 4)]
+	theta = np.arange(n)[:, None] * math.pi / n
+	s = np.arange(n)[None, :] - (n / 2) + 0.5
+	sinogram = np.zeros((n, n))
+	for x, y, r, mu in discs:
+		d = s - (x * np.cos(theta) + y * np.sin(theta))
+		sinogram = sinogram + 2 * mu * np.sqrt(np.clip(r ** 2 - d ** 2, 0, None))
+	sinogram = ramp_filter(sinogram, 1)
+
+	start = time.perf_counter()
+	direct = back_project(sinogram)
+	direct_time = time.perf_counter() - start
+	start = time.perf_counter()
+	hierarchical = back_project_hierarchical(sinogram, accuracy)
+	hierarchical_time = time.perf_counter() - start
+
+	inside = direct != -1
+	error = math.sqrt(np.mean((hierarchical[inside] - direct[inside]) ** 2) / np.mean(direct[inside] ** 2))
+	if not error <= tolerance:
+		raise ValueError('hierarchical back-projection differs by %g RMS, above %g' % (error, tolerance))
+
+	return {'direct': direct_time, 'hierarchical': hierarchical_time, 'speed-up': direct_time / hierarchical_time, 'error': error}
+
+def check_kernels(tolerance=1e-9):
+	"""check the numba kernels of ct_kernels against the numpy reference, with
+	check_backends, returning the largest difference for each kernel, or a note
+	that numba is not installed, in which case there is nothing to check"""
+
+	if not ct_kernels.have_numba:
+		return 'numba is not installed, so only the numpy backend is available'
+
+	return ct_kernels.check_backends(tolerance=tolerance)
+
+def check_memory(thresholds=None, n=128):
+	"""run a standard scan and reconstruction of an n x n phantom with ct_memory
+	recording on, and check the report against thresholds, as for
+	check_thresholds, which can also be the name of a JSON file of them.
+	Returns the report. The Material and Source data files must be in the
+	working directory."""
+
+	from material import Material
+	from source import Source
+	from ct_phantom import ct_phantom
+	from scan_and_reconstruct import scan_and_reconstruct
+
+	if thresholds is None:
+		thresholds = {}
+	elif isinstance(thresholds, str):
+		with open(thresholds) as f:
+			thresholds = json.load(f)
+
+	material = Material()
+	source = Source()
+	phantom = ct_phantom(material.name, n, 3)
+
+	ct_memory.reset()
+	ct_memory.start()
+	try:
+		scan_and_reconstruct(source.photon('100kVp, 3mm Al'), material, phantom, 0.01, n)
+	finally:
+		ct_memory.stop()
+
+	memory_report = ct_memory.report()
+	failures = ct_memory.check_thresholds(memory_report, thresholds)
+	if len(failures) > 0:
+		raise ValueError('thresholds exceeded: ' + ', '.join(failures))
+
+	return memory_report
+
+def check_dicom_writer(rsq=None, timeout=900):
+	"""check that writing compressed frames through a DicomWriter, after the
+	numba kernels have started their threads, gives the same frames as the
+	uncompressed path and lets the interpreter exit cleanly. reconstruct_all
+	is used on the Xtreme file rsq if given, or otherwise a synthetic volume is
+	written. The writing is done in a separate interpreter, which fails the
+	check if it has not exited within timeout seconds."""
+
+	with tempfile.TemporaryDirectory() as storage_directory:
+		command = ('import sys; sys.path.insert(0, sys.argv[1]); import ct_checks; '
+			+ 'ct_checks._write_dicom_frames(*sys.argv[2:])')
+		arguments = [os.path.dirname(os.path.abspath(__file__)), storage_directory]
+		if rsq is not None:
+			arguments.append(os.path.abspath(rsq))
+		try:
+			result = subprocess.run([sys.executable, '-c', command] + arguments, timeout=timeout)
+		except subprocess.TimeoutExpired:
+			raise ValueError('DicomWriter check did not exit within %g seconds' % timeout)
+
+	if result.returncode != 0:
+		raise ValueError('DicomWriter check exited with code %d' % result.returncode)
+
+	return 'passed'
+
+def _write_dicom_frames(storage_directory, rsq=None):
+	"""the part of check_dicom_writer run in a separate interpreter"""
+
+	from load_dicom import load_dicom_series
+
+	if ct_kernels.have_numba:
+		ct_kernels.set_backend('numba')
+		ct_kernels.check_backends()
+
+	if rsq is not None:
+		from xtreme import Xtreme
+		x = Xtreme(rsq)
+		os.chdir(storage_directory)
+		with DicomWriter(2, compress=True) as writer:
+			x.reconstruct_all('rle', writer=writer)
+		x.reconstruct_all('uncompressed')
+	else:
+		xi, yi = np.meshgrid(np.arange(128) - 63.5, np.arange(128) - 63.5)
+		volume = np.stack([np.where(xi ** 2 + yi ** 2 < 60 ** 2, 1024 + 10 * z, 0) for z in range(8)]).astype(np.uint16)
+		dicom_benchmark(volume, storage_directory, workers=2)
+
+	if not np.array_equal(load_dicom_series(storage_directory, 'rle', stored=True), load_dicom_series(storage_directory, 'uncompressed', stored=True)):
+		raise ValueError('compressed frames differ from uncompressed frames')
+
+checks = {'mtf': check_mtf, 'hierarchical': check_hierarchical, 'kernels': check_kernels, 'memory': check_memory,
+	'dicom_writer': check_dicom_writer}
+
+if __name__ == '__main__':
+
+	names = sys.argv[1:] if len(sys.argv) > 1 else list(checks)
+	failures = []
+	for name in names:
+		try:
+			print('%s: %s' % (name, checks[name]()))
+		except ValueError as e:
+			print('%s: FAILED %s' % (name, e))
+			failures.append(name)
+
+	sys.exit(1 if len(failures) > 0 else 0)
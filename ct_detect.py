@@ -1,6 +1,8 @@
 import numpy as np
 from attenuate import attenuate
+from ct_memory import instrument
 
+@instrument('ct_detect')
 def ct_detect(p, coeffs, depth, mas=10000, noise = True, additive_noise = True):
 
 	"""ct_detect returns detector photons for given material depths.
@@ -11,14 +13,26 @@ def ct_detect(p, coeffs, depth, mas=10000, noise = True, additive_noise = True):
 	in y (samples).
 
 	mas defines the current-time-product which affects the noise distribution
-	for the linear attenuation"""
+	for the linear attenuation
+
+	p can also hold several source energy distributions (spectra, energies),
+	such as from fake_sources, in which case the attenuation is found once
+	for all of them, and y is of size (spectra, samples). mas can then also
+	be one value for each spectrum"""
 
 	# check p for number of energies
 	if type(p) != np.ndarray:
 		p = np.array([p])
-	if p.ndim > 1:
-		raise ValueError('input p has more than one dimension')
-	energies = len(p)
+	if p.ndim > 2:
+		raise ValueError('input p has more than two dimensions')
+	energies = p.shape[-1]
+
+	# check mas is a single value, or one for each spectrum
+	mas = np.asarray(mas, dtype=float)
+	if mas.ndim > 0:
+		if p.ndim != 2 or mas.shape != (p.shape[0],):
+			raise ValueError('input mas must be a single value or one for each spectrum in p')
+		mas = mas[:, None]
 
 	# check coeffs is of (materials, energies)
 	if type(coeffs) != np.ndarray:
@@ -45,17 +59,22 @@ def ct_detect(p, coeffs, depth, mas=10000, noise = True, additive_noise = True):
 		raise ValueError('input depth has different number of materials to input coeffs')
 	samples = depth.shape[1]
 
-	# extend source photon array so it covers all samples
-	detector_photons = np.zeros([energies, samples])
-	for e in range(energies):
-		detector_photons[e] = p[e]
+	if p.ndim == 2:
+		# find the transmission at each energy once, and weight it by each spectrum
+		detector_photons = p @ np.exp(-(coeffs.T @ depth))
+
+	else:
+		# extend source photon array so it covers all samples
+		detector_photons = np.zeros([energies, samples])
+		for e in range(energies):
+			detector_photons[e] = p[e]
 
-	# calculate array of residual mev x samples for each material in turn
-	for m in range(materials):
-		detector_photons = attenuate(detector_photons, coeffs[m], depth[m])
+		# calculate array of residual mev x samples for each material in turn
+		for m in range(materials):
+			detector_photons = attenuate(detector_photons, coeffs[m], depth[m])
 
-	# sum this over energies
-	detector_photons = np.sum(detector_photons, axis=0)
+		# sum this over energies
+		detector_photons = np.sum(detector_photons, axis=0)
 
 	if noise:
 		# calculate number of photons expected
@@ -67,7 +86,9 @@ def ct_detect(p, coeffs, depth, mas=10000, noise = True, additive_noise = True):
 			background_level = 100							# Expected number of photons of background radiation incident per cm^2 over detection time
 			background = background_level * detector_area
 			scatter_coefficient = 0.00000001				# Expected proportion of photons incident on detector after multiple scatter
-			scattered = np.sum(p) * mas * detector_area * scatter_coefficient
+			scattered = np.sum(p, axis=-1, keepdims=True) * mas * detector_area * scatter_coefficient
+			if p.ndim == 1:
+				scattered = scattered[0]
 
 			detector_photons = detector_photons + background + scattered
 
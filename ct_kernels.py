@@ -0,0 +1,191 @@
+import numpy as np
+import math
+import scipy
+from scipy import ndimage
+
+# numba is optional, and the pure numpy versions are used without it
+try:
+	import numba
+	have_numba = True
+except ImportError:
+	have_numba = False
+
+# the numpy reference is used unless numba is chosen with set_backend
+_backend = 'numpy'
+
+def set_backend(name, threads=None):
+	"""choose the backend for the interpolation hot loops in ct_scan,
+	back_project and Xtreme.fan_to_parallel: 'numba' for the fused, compiled,
+	multi-threaded kernels, or 'numpy' for the reference numpy and scipy code,
+	which is the default. threads limits the number of threads the numba
+	kernels use. The numba kernels agree with the reference to round-off, as
+	checked by check_backends."""
+
+	global _backend
+	if name not in ('numba', 'numpy'):
+		raise ValueError('backend must be numba or numpy')
+	if name == 'numba' and not have_numba:
+		raise ImportError('numba is not installed, so only the numpy backend is available')
+	_backend = name
+	if threads is not None and have_numba:
+		numba.set_num_threads(threads)
+
+def get_backend():
+	"""the backend in use, as set by set_backend"""
+
+	return _backend
+
+def rotate_sum(image, p):
+	"""sum of the image (n x n) along the columns after rotating it by p about
+	its centre, as ct_scan does for each material, giving (n)"""
+
+	n = image.shape[0]
+	if _backend == 'numba':
+		out = np.zeros(n)
+		_rotate_sum(np.ascontiguousarray(image, dtype=float), math.cos(p), math.sin(p), out)
+		return out
+
+	xi, yi = np.meshgrid(np.arange(n) - (n/2) + 0.5, np.arange(n) - (n/2) + 0.5)
+	x0 = xi * math.cos(p) - yi * math.sin(p) + (n/2) - 0.5
+	y0 = xi * math.sin(p) + yi * math.cos(p) + (n/2) - 0.5
+	interpolated = scipy.ndimage.map_coordinates(image, [y0, x0], order=1, mode='constant', cval=0, prefilter=False)
+
+	return np.sum(interpolated, axis=0)
+
+def back_project_add(reconstruction, rows, xi, yi, p, weight):
+	"""add weight times the rows (... x samples) of one angle p, interpolated at
+	the rotated coordinates of (xi, yi), into reconstruction (... x xi.shape),
+	as back_project does for each angle"""
+
+	ns = rows.shape[-1]
+	if _backend == 'numba':
+		r = reconstruction.reshape((-1,) + (xi.size,))
+		_back_project_add(r, np.ascontiguousarray(rows, dtype=float).reshape(-1, ns), np.ascontiguousarray(xi, dtype=float).ravel(),
+			np.ascontiguousarray(yi, dtype=float).ravel(), math.cos(p), math.sin(p), weight)
+		return reconstruction
+
+	x0 = xi * math.cos(p) - yi * math.sin(p) + (ns / 2) - 0.5
+	if rows.ndim == 1:
+		x2 = scipy.ndimage.map_coordinates(rows, [x0], order=1, mode='constant', cval=0, prefilter=False)
+	else:
+		from back_project import interpolate_samples
+		x2 = interpolate_samples(rows, x0)
+	reconstruction += x2 * weight
+
+	return reconstruction
+
+def bilinear(X, yo, xo):
+	"""bilinear interpolation of X (angles x samples), or of each of a stack
+	(... x angles x samples), at (yo, xo), with zero outside, as map_coordinates"""
+
+	if _backend == 'numba':
+		stack = np.ascontiguousarray(X, dtype=float).reshape((-1,) + X.shape[-2:])
+		out = np.zeros((stack.shape[0], yo.size))
+		_bilinear(stack, np.ascontiguousarray(yo, dtype=float).ravel(), np.ascontiguousarray(xo, dtype=float).ravel(), out)
+		return out.reshape(X.shape[:-2] + yo.shape)
+
+	if X.ndim == 2:
+		return scipy.ndimage.map_coordinates(X, [yo, xo], None, 1, 'constant', 0, False)
+	return np.stack([scipy.ndimage.map_coordinates(x, [yo, xo], None, 1, 'constant', 0, False) for x in X.reshape((-1,) + X.shape[-2:])]).reshape(X.shape[:-2] + yo.shape)
+
+def check_backends(n=64, angles=16, tolerance=1e-9):
+	"""check that the numba kernels give the same results as the numpy
+	reference on random data, both for each kernel and for a whole
+	back_project, returning the largest absolute difference for each.
+	Raises ValueError if any difference is more than tolerance.
+
+	check_kernels in ct_checks.py runs this check."""
+
+	if not have_numba:
+		raise ImportError('numba is not installed, so there is nothing to compare')
+	from back_project import back_project
+
+	rng = np.random.default_rng(0)
+	image = rng.random((n, n))
+	rows = rng.random((3, n))
+	xi, yi = np.meshgrid(np.arange(n) - (n/2) + 0.5, np.arange(n) - (n/2) + 0.5)
+	X = rng.random((2, angles, n))
+	yo = rng.uniform(-1, angles, (angles, n))
+	xo = rng.uniform(-1, n, (angles, n))
+	sinogram = rng.random((2, angles, n))
+
+	previous = get_backend()
+	results = {}
+	try:
+		outputs = {}
+		for name in ('numpy', 'numba'):
+			set_backend(name)
+			outputs[name] = (np.stack([rotate_sum(image, -math.pi / 2 - a * math.pi / angles) for a in range(angles)]),
+				back_project_add(np.zeros((3, n, n)), rows, xi, yi, 0.3, 0.5),
+				bilinear(X, yo, xo),
+				back_project(sinogram))
+		for kernel, a, b in zip(('rotate_sum', 'back_project_add', 'bilinear', 'back_project'), outputs['numpy'], outputs['numba']):
+			results[kernel] = float(np.max(np.abs(a - b)))
+	finally:
+		set_backend(previous)
+
+	failures = [kernel for kernel, difference in results.items() if not difference <= tolerance]
+	if len(failures) > 0:
+		raise ValueError('numba kernels differ from the numpy reference: ' + ', '.join('%s %g' % (kernel, results[kernel]) for kernel in failures))
+
+	return results
+
+def _linear(row, x):
+	"""linear interpolation of row at x, with zero outside, for the kernels"""
+
+	ns = row.shape[0]
+	if x < 0 or x > ns - 1:
+		return 0.0
+	low = min(int(math.floor(x)), ns - 2)
+	f = x - low
+	return row[low] * (1 - f) + row[low + 1] * f
+
+if have_numba:
+
+	_linear = numba.njit(cache=True)(_linear)
+
+	@numba.njit(parallel=True, cache=True)
+	def _rotate_sum(image, c, s, out):
+		n = image.shape[0]
+		h = n / 2 - 0.5
+		for col in numba.prange(n):
+			xi = col - h
+			total = 0.0
+			for row in range(n):
+				yi = row - h
+				x0 = xi * c - yi * s + h
+				y0 = xi * s + yi * c + h
+				if x0 < 0 or x0 > n - 1 or y0 < 0 or y0 > n - 1:
+					continue
+				xl = min(int(math.floor(x0)), n - 2)
+				yl = min(int(math.floor(y0)), n - 2)
+				fx = x0 - xl
+				fy = y0 - yl
+				total += ((image[yl, xl] * (1 - fx) + image[yl, xl + 1] * fx) * (1 - fy)
+					+ (image[yl + 1, xl] * (1 - fx) + image[yl + 1, xl + 1] * fx) * fy)
+			out[col] = total
+
+	@numba.njit(parallel=True, cache=True)
+	def _back_project_add(reconstruction, rows, xi, yi, c, s, weight):
+		h = rows.shape[1] / 2 - 0.5
+		for k in numba.prange(xi.shape[0]):
+			x0 = xi[k] * c - yi[k] * s + h
+			for r in range(rows.shape[0]):
+				reconstruction[r, k] += _linear(rows[r], x0) * weight
+
+	@numba.njit(parallel=True, cache=True)
+	def _bilinear(X, yo, xo, out):
+		angles = X.shape[1]
+		samples = X.shape[2]
+		for k in numba.prange(yo.shape[0]):
+			y0 = yo[k]
+			x0 = xo[k]
+			if x0 < 0 or x0 > samples - 1 or y0 < 0 or y0 > angles - 1:
+				continue
+			xl = min(int(math.floor(x0)), samples - 2)
+			yl = min(int(math.floor(y0)), angles - 2)
+			fx = x0 - xl
+			fy = y0 - yl
+			for r in range(X.shape[0]):
+				out[r, k] = ((X[r, yl, xl] * (1 - fx) + X[r, yl, xl + 1] * fx) * (1 - fy)
+					+ (X[r, yl + 1, xl] * (1 - fx) + X[r, yl + 1, xl + 1] * fx) * fy)
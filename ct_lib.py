@@ -1,7 +1,16 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import numpy.matlib
+import collections
+import itertools
+import json
 import os
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
 
 def draw(data, map='gray', caxis=None):
 	"""Draw an image"""
@@ -50,6 +59,48 @@ def load_numpy_array(storage_directory, file_name):
 
 	return np.load(full_path)
 
+def open_volume(storage_directory, file_name, shape, dtype=np.uint16, metadata=None):
+	"""open a disk-backed, memory-mapped .npy volume (slices x rows x cols) for
+	writing one slice at a time, together with a .done.npy array of flags for
+	the slices which have been completed. An existing volume of the same shape
+	and dtype is reopened with its contents and flags, so an interrupted
+	reconstruction can carry on from where it stopped.
+
+	metadata is a dictionary of what the volume is made from, such as the
+	dataset and reconstruction settings, which is kept in a .json file beside
+	it. An existing volume is only reopened if its metadata is the same, and
+	otherwise a ValueError is raised, so a volume made with other settings is
+	not carried on with by mistake."""
+
+	full_path = get_full_path(storage_directory, file_name)
+	if not full_path.endswith('.npy'):
+		full_path = full_path + '.npy'
+	done_path = full_path[:-4] + '.done.npy'
+	metadata_path = full_path[:-4] + '.json'
+	shape = tuple(int(s) for s in shape)
+	metadata = json.loads(json.dumps({} if metadata is None else metadata, default=_json_default))
+
+	if os.path.exists(full_path) and os.path.exists(done_path):
+		volume = np.lib.format.open_memmap(full_path, mode='r+')
+		done = np.lib.format.open_memmap(done_path, mode='r+')
+		if volume.shape == shape and volume.dtype == np.dtype(dtype) and done.shape == shape[:1]:
+			existing = {}
+			if os.path.exists(metadata_path):
+				with open(metadata_path) as f:
+					existing = json.load(f)
+			if existing != metadata:
+				raise ValueError('volume ' + full_path + ' was made with different settings: ' + str(existing))
+			return volume, done
+		del volume, done
+
+	# the metadata is written first, so a volume is never reopened without it
+	with open(metadata_path, mode='w') as f:
+		json.dump(metadata, f, indent=1)
+	volume = np.lib.format.open_memmap(full_path, mode='w+', dtype=dtype, shape=shape)
+	done = np.lib.format.open_memmap(done_path, mode='w+', dtype=bool, shape=shape[:1])
+
+	return volume, done
+
 def get_full_path(storage_directory, file_name):
 	#create storage_directory if needed
 	if not os.path.exists(storage_directory):
@@ -75,3 +126,616 @@ def create_figure(data, map, caxis = None):
 
 	#add colorbar
 	plt.colorbar(im, orientation='vertical')
+
+
+def save_image(data, storage_directory, file_name, map='gray', caxis=None):
+	"""save an image directly as a windowed png, without a figure
+
+	This is much faster than save_draw, as the data is windowed to caxis (or
+	its own range if caxis is not given), mapped through the colour map, and
+	written straight to file. Use save_colorbar for the matching colorbar."""
+
+	full_path = get_full_path(storage_directory, file_name)
+	if not full_path.endswith('.png'):
+		full_path = full_path + '.png'
+
+	write_png(full_path, window_image(data, map, caxis))
+
+def save_montage(images, storage_directory, file_name, columns=None, map='gray', caxis=None):
+	"""save a stack of images (images x rows x cols) tiled into one png, with
+	columns images per row, all windowed to the same caxis (or the range of
+	the whole stack if caxis is not given)"""
+
+	images = np.asarray(images)
+	if images.ndim != 3:
+		raise ValueError('input images must be a stack of images')
+	count, rows, cols = images.shape
+	if columns is None:
+		columns = int(np.ceil(np.sqrt(count)))
+	lines = int(np.ceil(count / columns))
+
+	# window the whole stack at once, then tile it with a one pixel border
+	if caxis is None:
+		caxis = (np.min(images), np.max(images))
+	windowed = window_image(images, map, caxis)
+	montage = np.zeros((lines * (rows + 1) - 1, columns * (cols + 1) - 1) + windowed.shape[3:], dtype=np.uint8)
+	for index in range(count):
+		r, c = (index // columns) * (rows + 1), (index % columns) * (cols + 1)
+		montage[r:r + rows, c:c + cols] = windowed[index]
+
+	full_path = get_full_path(storage_directory, file_name)
+	if not full_path.endswith('.png'):
+		full_path = full_path + '.png'
+
+	write_png(full_path, montage)
+
+def save_colorbar(storage_directory, file_name, map='gray', caxis=(0, 1)):
+	"""save a colorbar for the given map and caxis, which only needs drawing
+	once for a batch of images saved with the same settings"""
+
+	fig, ax = plt.subplots(figsize=(1.2, 4))
+	plt.colorbar(plt.cm.ScalarMappable(norm=plt.Normalize(caxis[0], caxis[1]), cmap=map), cax=ax, orientation='vertical')
+	plt.tight_layout()
+
+	full_path = get_full_path(storage_directory, file_name)
+	plt.savefig(full_path)
+	plt.close(fig)
+
+def window_image(data, map='gray', caxis=None):
+	"""window data to caxis (or its own range) and map it to uint8 grey levels,
+	or uint8 rgb values (with a final axis of 3) for maps other than gray"""
+
+	data = np.asarray(data, dtype=float)
+	if caxis is None:
+		caxis = (np.min(data), np.max(data))
+	low, high = float(caxis[0]), float(caxis[1])
+
+	# scale to 0 to 255 in place on the float copy
+	level = data - low
+	level *= 255 / (high - low) if high > low else 0
+	np.clip(level, 0, 255, out=level)
+	level = np.rint(level).astype(np.uint8)
+
+	if map == 'gray':
+		return level
+
+	# use a lookup table from the colour map
+	table = (plt.get_cmap(map)(np.arange(256))[:, :3] * 255).round().astype(np.uint8)
+	return table[level]
+
+def write_png(full_path, image):
+	"""write a uint8 grey (rows x cols) or rgb (rows x cols x 3) image as a png"""
+
+	image = np.ascontiguousarray(image, dtype=np.uint8)
+	rows, cols = image.shape[:2]
+	colour = 2 if image.ndim == 3 else 0
+
+	# each row is prefixed by a filter type byte of zero
+	raw = np.zeros((rows, 1 + image[0].size), dtype=np.uint8)
+	raw[:, 1:] = image.reshape(rows, -1)
+
+	def chunk(kind, body):
+		return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body) & 0xffffffff)
+
+	with open(full_path, 'wb') as f:
+		f.write(b'\x89PNG\r\n\x1a\n')
+		f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, colour, 0, 0, 0)))
+		f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 1)))
+		f.write(chunk(b'IEND', b''))
+
+
+class ImageWriter(object):
+	def __init__(self, map='gray', caxis=None):
+		"""ImageWriter saves images and montages on a background thread, so that
+		the caller can carry on with the next reconstruction. The map and caxis
+		given are the defaults for every image in the batch. close() waits for
+		all images to be written, and raises any error from the writer thread.
+
+		with ImageWriter(caxis=(-1024, 3071)) as writer:
+			writer.save_image(y, 'results', 'image')"""
+
+		self.map = map
+		self.caxis = caxis
+		self._error = None
+		self._queue = queue.Queue()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def save_image(self, data, storage_directory, file_name, map=None, caxis=None):
+		"""queue an image to be saved with save_image"""
+
+		self._queue.put((save_image, (np.array(data), storage_directory, file_name, map or self.map, caxis if caxis is not None else self.caxis)))
+
+	def save_montage(self, images, storage_directory, file_name, columns=None, map=None, caxis=None):
+		"""queue a stack of images to be saved with save_montage"""
+
+		self._queue.put((save_montage, (np.array(images), storage_directory, file_name, columns, map or self.map, caxis if caxis is not None else self.caxis)))
+
+	def save_colorbar(self, storage_directory, file_name):
+		"""save the colorbar for this batch, from the calling thread as pyplot
+		is not thread safe"""
+
+		if self.caxis is None:
+			raise ValueError('a colorbar needs the caxis of the batch')
+		save_colorbar(storage_directory, file_name, self.map, self.caxis)
+
+	def close(self):
+		"""wait for all queued images to be written"""
+
+		self._queue.put(None)
+		self._thread.join()
+		if self._error is not None:
+			raise self._error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+			if self._error is None:
+				try:
+					item[0](*item[1])
+				except Exception as e:
+					self._error = e
+
+
+def save_chunked_array(data, storage_directory, file_name, chunks=None, compression=6, metadata=None):
+	"""save a numpy array in a chunked store, with per-chunk compression"""
+
+	store = ChunkedArray(storage_directory, file_name, 'w', data.shape, data.dtype, chunks, compression, metadata)
+	store[...] = data
+	store.flush()
+
+	return store
+
+def open_chunked_array(storage_directory, file_name, mode='r', shape=None, dtype=float, chunks=None, compression=6, metadata=None):
+	"""open a chunked store for reading (mode 'r'), updating (mode 'r+') or
+	create a new one (mode 'w') of the given shape and dtype"""
+
+	return ChunkedArray(storage_directory, file_name, mode, shape, dtype, chunks, compression, metadata)
+
+def load_chunked_array(storage_directory, file_name, index=Ellipsis):
+	"""load all of a chunked store, or just the part given by index, for example
+	np.s_[10:20] for a range of slices or angles, or np.s_[:, 100:200, 100:200]
+	for a region of interest. Only the chunks which overlap index are read."""
+
+	return ChunkedArray(storage_directory, file_name)[index]
+
+
+class ChunkedArray(object):
+	def __init__(self, storage_directory, file_name, mode='r', shape=None, dtype=float, chunks=None, compression=6, metadata=None):
+		"""ChunkedArray holds an array stored as a directory of chunk files,
+		named file_name.chunks, together with a header.json of the shape, dtype,
+		chunk shape, compression level and a metadata dictionary (such as scale,
+		angles, spectrum and UIDs), which is available as the metadata attribute.
+
+		The array is read and written by indexing with integers and slices, and
+		only the chunks overlapping the index are touched. Chunks are compressed
+		with zlib at the given level, or stored raw if compression is 0, in which
+		case they are read through memory maps. Chunks which have never been
+		written read as zeros.
+
+		Writes are buffered per chunk, and each chunk is written to disk as soon
+		as all of it has been set. flush() writes any partly set chunks.
+
+		Reading a selection which lies within one chunk, which is not partly
+		written, returns a read-only view of the chunk rather than a copy, so raw
+		chunks are read straight from their memory maps.
+
+		It can be used in place of an array as the output of ct_scan and Xtreme,
+		and as the sinogram input to back_project and its out."""
+
+		self.path = os.path.join(storage_directory, file_name)
+		if not self.path.endswith('.chunks'):
+			self.path = self.path + '.chunks'
+		self.mode = mode
+
+		if mode == 'w':
+			if shape is None:
+				raise ValueError('shape must be given to create a chunked array')
+			shape = tuple(int(s) for s in np.atleast_1d(shape))
+			dtype = np.dtype(dtype)
+
+			# default to chunks of about 1MB, split along the first axis only
+			if chunks is None:
+				rest = dtype.itemsize * int(np.prod(shape[1:]))
+				chunks = (int(np.clip(2 ** 20 // max(rest, 1), 1, shape[0])),) + shape[1:]
+			chunks = tuple(int(c) for c in chunks)
+			if len(chunks) != len(shape):
+				raise ValueError('chunks has different number of dimensions to shape')
+
+			self.shape, self.dtype, self.chunks = shape, dtype, chunks
+			self.compression = int(compression)
+			self.metadata = {} if metadata is None else dict(metadata)
+
+			# clear any existing store of the same name
+			if os.path.exists(self.path):
+				for name in os.listdir(self.path):
+					os.remove(os.path.join(self.path, name))
+			get_full_path(self.path, '')
+			self._write_header()
+
+		elif mode in ('r', 'r+'):
+			header_path = os.path.join(self.path, 'header.json')
+			if not os.path.exists(header_path):
+				raise Exception('Chunked array named ' + self.path + ' does not exist')
+			with open(header_path) as f:
+				header = json.load(f)
+			self.shape = tuple(header['shape'])
+			self.dtype = np.dtype(header['dtype'])
+			self.chunks = tuple(header['chunks'])
+			self.compression = header['compression']
+			self.metadata = header['metadata']
+
+		else:
+			raise ValueError('mode must be one of r, r+ or w')
+
+		self.ndim = len(self.shape)
+		self._dirty = {}
+		self._cache = collections.OrderedDict()
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __array__(self, dtype=None, copy=None):
+		data = self[...]
+		return data if dtype is None else data.astype(dtype)
+
+	def __getitem__(self, index):
+		ranges, steps, squeeze = self._ranges(index)
+
+		overlaps = list(self._overlaps(ranges))
+		if len(overlaps) == 1 and overlaps[0][0] not in self._dirty:
+			# a selection within one chunk is a view of it, which for raw chunks
+			# is memory mapped
+			chunk, inner, outer = overlaps[0]
+			out = self._chunk(chunk)[inner]
+		else:
+			# copy each overlapping chunk into the output
+			out = np.zeros([stop - start for start, stop in ranges], dtype=self.dtype)
+			for chunk, inner, outer in overlaps:
+				out[outer] = self._chunk(chunk)[inner]
+
+		out = out[tuple(slice(None, None, step) for step in steps)]
+		return out[tuple(0 if s else slice(None) for s in squeeze)]
+
+	def __setitem__(self, index, value):
+		if self.mode == 'r':
+			raise ValueError('chunked array is open for reading only')
+
+		ranges, steps, squeeze = self._ranges(index)
+		if any(step != 1 for step in steps):
+			raise ValueError('chunked array writes do not support steps')
+
+		# broadcast value to the full selection, including dropped dimensions
+		value = np.asarray(value, dtype=self.dtype)
+		value = np.broadcast_to(value, [stop - start for (start, stop), s in zip(ranges, squeeze) if not s])
+		value = value.reshape([stop - start for start, stop in ranges])
+
+		for chunk, inner, outer in self._overlaps(ranges):
+			if chunk not in self._dirty:
+				self._dirty[chunk] = (np.array(self._chunk(chunk)), np.zeros(self._chunk_shape(chunk), dtype=bool))
+				self._cache.pop(chunk, None)
+			data, written = self._dirty[chunk]
+			data[inner] = value[outer]
+			written[inner] = True
+
+			# write out complete chunks straight away
+			if written.all():
+				self._write_chunk(chunk, data)
+				del self._dirty[chunk]
+
+	def flush(self):
+		"""write any partly set chunks, and the header, to disk"""
+
+		for chunk, (data, written) in self._dirty.items():
+			self._write_chunk(chunk, data)
+		self._dirty = {}
+		if self.mode != 'r':
+			self._write_header()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.flush()
+
+	def _write_header(self):
+		header = {'shape': self.shape, 'dtype': self.dtype.str, 'chunks': self.chunks,
+			'compression': self.compression, 'metadata': self.metadata}
+		with open(os.path.join(self.path, 'header.json'), mode='w') as f:
+			json.dump(header, f, default=_json_default)
+
+	def _ranges(self, index):
+		"""convert an index into (start, stop) ranges, steps, and dimensions to drop"""
+
+		if not isinstance(index, tuple):
+			index = (index,)
+		if Ellipsis in index:
+			e = index.index(Ellipsis)
+			index = index[:e] + (slice(None),) * (self.ndim - len(index) + 1) + index[e + 1:]
+		if len(index) > self.ndim:
+			raise IndexError('too many indices for chunked array')
+		index = index + (slice(None),) * (self.ndim - len(index))
+
+		ranges, steps, squeeze = [], [], []
+		for i, size in zip(index, self.shape):
+			if isinstance(i, slice):
+				start, stop, step = i.indices(size)
+				if step < 0:
+					raise IndexError('chunked array does not support negative steps')
+				ranges.append((start, max(start, stop)))
+				steps.append(step)
+				squeeze.append(False)
+			else:
+				i = int(i)
+				if i < 0:
+					i = i + size
+				if i < 0 or i >= size:
+					raise IndexError('index out of range for chunked array')
+				ranges.append((i, i + 1))
+				steps.append(1)
+				squeeze.append(True)
+
+		return ranges, steps, squeeze
+
+	def _overlaps(self, ranges):
+		"""chunk indices overlapping ranges, with the index within each chunk and
+		the matching index within the selection"""
+
+		grid = [range(start // c, (stop - 1) // c + 1) if stop > start else range(0) for (start, stop), c in zip(ranges, self.chunks)]
+		for chunk in itertools.product(*grid):
+			inner, outer = [], []
+			for k, (start, stop), c in zip(chunk, ranges, self.chunks):
+				lo, hi = max(start, k * c), min(stop, (k + 1) * c)
+				inner.append(slice(lo - k * c, hi - k * c))
+				outer.append(slice(lo - start, hi - start))
+			yield chunk, tuple(inner), tuple(outer)
+
+	def _chunk_shape(self, chunk):
+		return tuple(min(c, size - k * c) for k, c, size in zip(chunk, self.chunks, self.shape))
+
+	def _chunk_path(self, chunk):
+		return os.path.join(self.path, '.'.join(str(k) for k in chunk))
+
+	def _chunk(self, chunk):
+		"""read a chunk, through the dirty and recently read chunks first"""
+
+		if chunk in self._dirty:
+			return self._dirty[chunk][0]
+		if chunk in self._cache:
+			self._cache.move_to_end(chunk)
+			return self._cache[chunk]
+
+		shape = self._chunk_shape(chunk)
+		full_path = self._chunk_path(chunk)
+		if not os.path.exists(full_path):
+			data = np.zeros(shape, dtype=self.dtype)
+			data.setflags(write=False)
+		elif self.compression:
+			with open(full_path, 'rb') as f:
+				data = np.frombuffer(zlib.decompress(f.read()), dtype=self.dtype).reshape(shape)
+		else:
+			data = np.memmap(full_path, dtype=self.dtype, mode='r', shape=shape)
+
+		# keep a few recently read chunks, for row by row access
+		self._cache[chunk] = data
+		if len(self._cache) > 16:
+			self._cache.popitem(last=False)
+
+		return data
+
+	def _write_chunk(self, chunk, data):
+		full_path = self._chunk_path(chunk)
+		data = np.ascontiguousarray(data, dtype=self.dtype)
+		with open(full_path + '.tmp', 'wb') as f:
+			if self.compression:
+				f.write(zlib.compress(data.tobytes(), self.compression))
+			else:
+				f.write(data.tobytes())
+		os.replace(full_path + '.tmp', full_path)
+		self._cache.pop(chunk, None)
+
+def _json_default(value):
+	"""convert numpy values in metadata to json types"""
+
+	if isinstance(value, np.ndarray):
+		return value.tolist()
+	if isinstance(value, np.generic):
+		return value.item()
+	raise TypeError('metadata value of type ' + type(value).__name__ + ' cannot be saved')
+
+def open_manifest(storage_directory, file_name, contents):
+	"""open a JSON manifest shared by every process working on one job. If it
+	does not exist it is created from the dictionary contents, and otherwise the
+	existing manifest is returned, so every process (and any restart) uses the
+	same settings, such as DICOM UIDs. Creation is atomic, so if several
+	processes start at once they all get the manifest of the first."""
+
+	full_path = get_full_path(storage_directory, file_name)
+	if not full_path.endswith('.json'):
+		full_path = full_path + '.json'
+
+	if not os.path.exists(full_path):
+		# link the complete file into place, which fails if another process got there first
+		temp_path = full_path + '.' + socket.gethostname() + '-' + str(os.getpid()) + '.tmp'
+		with open(temp_path, mode='w') as f:
+			json.dump(contents, f, indent=1, default=_json_default)
+		try:
+			os.link(temp_path, full_path)
+		except FileExistsError:
+			pass
+		finally:
+			os.remove(temp_path)
+
+	with open(full_path) as f:
+		return json.load(f)
+
+def update_manifest(storage_directory, file_name, contents):
+	"""replace a manifest from open_manifest with the dictionary contents, atomically"""
+
+	full_path = get_full_path(storage_directory, file_name)
+	if not full_path.endswith('.json'):
+		full_path = full_path + '.json'
+
+	temp_path = full_path + '.' + socket.gethostname() + '-' + str(os.getpid()) + '.tmp'
+	with open(temp_path, mode='w') as f:
+		json.dump(contents, f, indent=1, default=_json_default)
+	os.replace(temp_path, full_path)
+
+class WorkQueue(object):
+	def __init__(self, storage_directory, file_name, worker=None, timeout=600):
+		"""WorkQueue shares numbered items of work between processes, on one
+		machine or on several sharing a filesystem, using a directory of marker
+		files named file_name.queue. An item is taken with claim(item), which
+		creates an <item>.claim.0 file holding the worker name, and succeeds only
+		for the one process which created it. finish(item) then adds an
+		<item>.done file, so completed() lists the items which are complete.
+
+		worker names this process, and defaults to the CT_WORKER environment
+		variable if it is set, or otherwise the host name and process id. A
+		claim by the same worker name is taken again, so a process restarted
+		with a stable worker name carries on with its own items straight away.
+
+		While an item is held, a background thread touches its claim every
+		quarter of timeout seconds. A claim which has not been touched for
+		timeout seconds is taken to belong to a process which has stopped, and
+		can be taken over by another, which creates the claim of the next
+		generation, <item>.claim.1 and so on. Only one process can create each
+		generation, and claims are never removed, so two processes can never
+		both take over the same claim. timeout None never takes over claims.
+		close() stops the background thread."""
+
+		self.path = os.path.join(storage_directory, file_name + '.queue')
+		os.makedirs(self.path, exist_ok=True)
+		if worker is None:
+			worker = os.environ.get('CT_WORKER', socket.gethostname() + '-' + str(os.getpid()))
+		self.worker = str(worker)
+		self.timeout = timeout
+
+		# claims held by this worker, by item, with their generation
+		self._held = {}
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._heartbeat = None
+
+	def claim(self, item):
+		"""try to take item, returning True if this worker now holds it"""
+
+		if self.is_done(item):
+			return False
+
+		generation, owner, age = self._current(item)
+		if generation is None:
+			if self._create(item, 0):
+				return True
+			generation, owner, age = self._current(item)
+			if generation is None:
+				return False
+
+		if owner == self.worker:
+			self._hold(item, generation)
+			return True
+		if self.timeout is None or age < self.timeout:
+			return False
+
+		# take over the stale claim, which only one process can do
+		return self._create(item, generation + 1)
+
+	def close(self):
+		"""stop touching the claims held"""
+
+		self._stop.set()
+		if self._heartbeat is not None:
+			self._heartbeat.join()
+			self._heartbeat = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _claim_path(self, item, generation):
+		return os.path.join(self.path, str(item) + '.claim.' + str(generation))
+
+	def _current(self, item):
+		"""the latest generation of the claim on item, with its owner and age in
+		seconds, or None for each if item has not been claimed"""
+
+		generation = None
+		while os.path.exists(self._claim_path(item, 0 if generation is None else generation + 1)):
+			generation = 0 if generation is None else generation + 1
+		if generation is None:
+			return None, None, None
+
+		claim_path = self._claim_path(item, generation)
+		with open(claim_path) as f:
+			owner = f.read()
+		age = time.time() - os.path.getmtime(claim_path)
+
+		return generation, owner, age
+
+	def _create(self, item, generation):
+		"""create the claim of this generation on item, if no other process has"""
+
+		try:
+			fd = os.open(self._claim_path(item, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			return False
+		with os.fdopen(fd, mode='w') as f:
+			f.write(self.worker)
+		self._hold(item, generation)
+
+		return True
+
+	def _hold(self, item, generation):
+		"""keep the claim on item fresh until it is finished"""
+
+		with self._lock:
+			self._held[item] = generation
+		if self.timeout is not None and self._heartbeat is None:
+			self._stop.clear()
+			self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+			self._heartbeat.start()
+
+	def _beat(self):
+		"""touch the claims held, until close is called"""
+
+		while not self._stop.wait(self.timeout / 4):
+			with self._lock:
+				held = list(self._held.items())
+			for item, generation in held:
+				# stop touching a claim which has been taken over
+				if os.path.exists(self._claim_path(item, generation + 1)):
+					with self._lock:
+						self._held.pop(item, None)
+					continue
+				try:
+					os.utime(self._claim_path(item, generation))
+				except FileNotFoundError:
+					pass
+
+	def finish(self, item):
+		"""mark item as complete"""
+
+		with open(os.path.join(self.path, str(item) + '.done'), mode='w') as f:
+			f.write(self.worker)
+		with self._lock:
+			self._held.pop(item, None)
+
+	def is_done(self, item):
+		"""True if item has been completed"""
+
+		return os.path.exists(os.path.join(self.path, str(item) + '.done'))
+
+	def completed(self):
+		"""sorted list of the completed items"""
+
+		return sorted(int(name[:-5]) for name in os.listdir(self.path) if name.endswith('.done'))
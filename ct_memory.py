@@ -0,0 +1,172 @@
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# resource is only available on unix
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# recording is off until start is called, so instrumented functions only cost a check
+_enabled = False
+_started_tracing = False
+_count_blocks = False
+_stages = {}
+_stack = []
+
+def start(blocks=False):
+	"""start recording the memory used by each instrumented stage, with
+	tracemalloc, which slows everything down while it is on. If blocks is
+	True, the number of memory blocks each stage leaves allocated is also
+	recorded, from tracemalloc snapshots taken at every call and return,
+	which is slower again, in proportion to the number of blocks in use."""
+
+	global _enabled, _started_tracing, _count_blocks
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+		_started_tracing = True
+	_count_blocks = blocks
+	_enabled = True
+
+def stop():
+	"""stop recording, keeping the records so far for report"""
+
+	global _enabled, _started_tracing
+	_enabled = False
+	if _started_tracing:
+		tracemalloc.stop()
+		_started_tracing = False
+
+def reset():
+	"""clear the records so far"""
+
+	_stages.clear()
+
+def instrument(stage):
+	"""decorator which records calls of a function as the named stage, once
+	start has been called. For each stage the report holds:
+
+	'calls' - number of calls
+	'time' - total time in seconds
+	'peak_increase_total' - total over the calls of the most memory
+	allocated at once above that in use when called, so temporaries are
+	included, but memory allocated and freed again within a call only counts
+	once
+	'retained' - total memory still allocated at return, such as the output
+	'blocks' - total number of memory blocks still allocated at return above
+	those at the call, such as the output arrays, if start was called with
+	blocks True, or None
+	'peak' - the most memory allocated at once in any one call
+	'peak_rss' - peak resident memory of the process at the last call
+
+	Memory is in bytes, and includes that of any stages called from within
+	the stage."""
+
+	def decorate(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not _enabled:
+				return function(*args, **kwargs)
+			return _record(stage, function, args, kwargs)
+		return wrapper
+
+	return decorate
+
+def report():
+	"""machine-readable dictionary of the records so far, with 'stages' from
+	stage name to its record, and the 'peak_rss' of the process"""
+
+	return {'stages': {stage: dict(record) for stage, record in _stages.items()}, 'peak_rss': _peak_rss()}
+
+def save_report(storage_directory, file_name, memory_report=None):
+	"""save a report (the current one by default) as JSON"""
+
+	if memory_report is None:
+		memory_report = report()
+
+	# ct_lib is not used for this, so that the instrumented modules do not
+	# all import matplotlib
+	os.makedirs(storage_directory, exist_ok=True)
+	full_path = os.path.join(storage_directory, file_name)
+	with open(full_path, mode='w') as f:
+		json.dump(memory_report, f, indent=1)
+
+def check_thresholds(memory_report, thresholds):
+	"""compare a report with thresholds, a dictionary from stage name to a
+	dictionary of limits on its records, such as {'back_project': {'peak': 1e8}},
+	which can also give a limit on the process 'peak_rss'. Returns a list of
+	the limits which are exceeded, which is empty if all are met. A stage
+	which has not been recorded meets its limits."""
+
+	failures = []
+	for stage, limits in thresholds.items():
+		if stage == 'peak_rss':
+			if memory_report['peak_rss'] is not None and memory_report['peak_rss'] > limits:
+				failures.append('peak_rss %d > %d' % (memory_report['peak_rss'], limits))
+			continue
+		record = memory_report['stages'].get(stage)
+		if record is None:
+			continue
+		for name, limit in limits.items():
+			if name not in record:
+				raise KeyError('Unknown record ' + name + ' for stage ' + stage)
+			if record[name] is not None and record[name] > limit:
+				failures.append('%s %s %g > %g' % (stage, name, record[name], limit))
+
+	return failures
+
+def _record(stage, function, args, kwargs):
+	"""call function, recording its memory use as stage"""
+
+	current, peak = tracemalloc.get_traced_memory()
+
+	# keep the peak so far of any enclosing stage, before it is reset for this
+	# one, which also leaves out the memory of the snapshot of the blocks
+	if len(_stack) > 0:
+		_stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+	blocks = _traced_blocks() if _count_blocks else None
+	tracemalloc.reset_peak()
+	frame = {'peak': current}
+	_stack.append(frame)
+
+	start_time = time.perf_counter()
+	try:
+		return function(*args, **kwargs)
+	finally:
+		elapsed = time.perf_counter() - start_time
+		_stack.pop()
+		end, peak = tracemalloc.get_traced_memory()
+		peak = max(frame['peak'], peak)
+		if blocks is not None:
+			blocks = _traced_blocks() - blocks
+			tracemalloc.reset_peak()
+		if len(_stack) > 0:
+			_stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+
+		record = _stages.setdefault(stage, {'calls': 0, 'time': 0.0, 'peak_increase_total': 0, 'retained': 0,
+			'blocks': None, 'peak': 0, 'peak_rss': None})
+		record['calls'] += 1
+		record['time'] += elapsed
+		record['peak_increase_total'] += peak - current
+		record['retained'] += end - current
+		if blocks is not None:
+			record['blocks'] = (record['blocks'] or 0) + blocks
+		record['peak'] = max(record['peak'], peak - current)
+		record['peak_rss'] = _peak_rss()
+
+def _traced_blocks():
+	"""number of memory blocks currently traced by tracemalloc"""
+
+	return len(tracemalloc.take_snapshot().traces)
+
+def _peak_rss():
+	"""peak resident memory of the process in bytes, or None if not known"""
+
+	if resource is None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss if sys.platform == 'darwin' else rss * 1024
@@ -0,0 +1,187 @@
+import numpy as np
+import scipy
+from scipy import ndimage
+
+def rmse(x, y):
+	"""root mean square error between images
+	e = rmse(x, y) returns the root mean square error between x and y, which are
+	either single images (rows x cols) or stacks of images (images x rows x cols),
+	with one value per image."""
+
+	(x, single), (y, _) = _stack(x), _stack(y)
+	e = np.sqrt(np.mean((x - y) ** 2, axis=(-2, -1)))
+
+	return e[0] if single else e
+
+def psnr(x, y, peak=255):
+	"""peak signal to noise ratio between images, in dB
+	p = psnr(x, y, peak) returns the PSNR between x and y (single images or stacks
+	of images) for a maximum signal value of peak."""
+
+	e = rmse(x, y)
+	with np.errstate(divide='ignore'):
+		p = 20 * np.log10(peak / e)
+
+	return p
+
+def ssim(x, y, L=255, window=7, sigma=None):
+	"""windowed structural similarity index between images
+	s = ssim(x, y, L) returns the mean SSIM between x and y (single images or
+	stacks of images) with dynamic range L, using local statistics in a square
+	box window of side window.
+
+	s = ssim(x, y, L, sigma=sigma) uses a Gaussian window with standard deviation
+	sigma (in pixels) instead.
+
+	The local means, variances and covariance are found with separable filters
+	applied along the image axes only, so a whole stack of images is scored at once."""
+
+	(x, single), (y, _) = _stack(x), _stack(y)
+	x, y = x.astype(float), y.astype(float)
+	c1, c2 = (0.01 * L) ** 2, (0.03 * L) ** 2
+
+	# separable local mean over the last two axes of the stack
+	if sigma is None:
+		local = lambda z : ndimage.uniform_filter(z, size=(1, window, window), mode='reflect')
+	else:
+		local = lambda z : ndimage.gaussian_filter(z, sigma=(0, sigma, sigma), mode='reflect', truncate=3.5)
+
+	mx, my = local(x), local(y)
+	vx = local(x * x) - mx * mx
+	vy = local(y * y) - my * my
+	cxy = local(x * y) - mx * my
+
+	s = (2 * mx * my + c1) * (2 * cxy + c2) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+
+	s = np.mean(s, axis=(-2, -1))
+
+	return s[0] if single else s
+
+def roi_statistics(x, labels, indices=None):
+	"""statistics of an image within each labelled region
+	mean, std, count = roi_statistics(x, labels) returns the mean, standard
+	deviation and pixel count of x (image or stack of images) for each material
+	index in labels, for example a phantom from ct_phantom. The outputs are of
+	size (images x materials), with materials given by np.arange(labels.max() + 1)
+	unless a list of material indices is given in indices.
+
+	Regions containing no pixels have a mean and standard deviation of nan."""
+
+	x, single = _stack(x)
+	x = x.astype(float)
+	labels = np.asarray(labels).astype(int)
+	if labels.shape != x.shape[-2:]:
+		raise ValueError('input labels has different size to input x')
+
+	if indices is None:
+		indices = np.arange(labels.max() + 1)
+	indices = np.asarray(indices)
+
+	# sum values and squares per label for every image in one pass
+	images = x.shape[0]
+	materials = max(labels.max(), indices.max()) + 1
+	offset = (np.arange(images) * materials)[:, None, None] + labels[None, :, :]
+	count = np.bincount(labels.ravel(), minlength=materials)[indices]
+	total = np.bincount(offset.ravel(), weights=x.ravel(), minlength=images * materials).reshape(images, materials)[:, indices]
+	square = np.bincount(offset.ravel(), weights=(x * x).ravel(), minlength=images * materials).reshape(images, materials)[:, indices]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		mean = total / count
+		std = np.sqrt(np.clip(square / count - mean * mean, 0, None))
+
+	count = np.broadcast_to(count, mean.shape)
+
+	if single:
+		return mean[0], std[0], count[0]
+	return mean, std, count
+
+def mtf(x, scale, centre=None, window=16):
+	"""modulation transfer function from an impulse reconstruction
+	f, m = mtf(x, scale) returns the spatial frequencies f (cycles per cm, up to
+	the Nyquist frequency) and the normalised MTF m of the reconstruction x (image
+	or stack of images) of the type 2 point attenuator phantom from ct_phantom,
+	with pixel size scale in cm. x should be the reconstructed attenuation, as
+	Hounsfield Units are clipped.
+
+	The point spread function is the square of window pixels either side of the
+	impulse, which is found at the largest value of each image unless its
+	(row, col) is given in centre. The background, the median of the edge of the
+	square, is removed, and the outer half of the square is tapered to zero
+	with a raised cosine. The MTF
+	is the magnitude of its 2D FFT, averaged over all directions at each
+	frequency, so the blur of the back-projection at every angle is included,
+	and normalised by its largest value, so it is at most 1. It is found for
+	the whole stack at once, and mtf50 gives the frequency at which it falls to
+	half."""
+
+	x, single = _stack(x)
+	x = x.astype(float)
+	images, n = x.shape[0], x.shape[-1]
+
+	# find the impulse in each image
+	if centre is None:
+		peak = np.argmax(x.reshape(images, -1), axis=-1)
+		rows, cols = peak // x.shape[-1], peak % x.shape[-1]
+	else:
+		rows, cols = np.full(images, centre[0]), np.full(images, centre[1])
+
+	# cut out the square around each impulse, padding past the edges
+	x = np.pad(x, ((0, 0), (window, window), (window, window)), mode='edge')
+	offsets = np.arange(2 * window + 1)
+	psf = x[np.arange(images)[:, None, None], (rows[:, None] + offsets)[:, :, None], (cols[:, None] + offsets)[:, None, :]]
+
+	# remove the background, taken from the edge of the square, and taper
+	edge = np.concatenate((psf[:, 0, :], psf[:, -1, :], psf[:, 1:-1, 0], psf[:, 1:-1, -1]), axis=-1)
+	taper = np.ones(2 * window + 1)
+	ends = window // 2
+	taper[:ends] = 0.5 - 0.5 * np.cos(np.pi * np.arange(1, ends + 1) / (ends + 1))
+	taper[len(taper) - ends:] = taper[:ends][::-1]
+	psf = (psf - np.median(edge, axis=-1)[:, None, None]) * np.outer(taper, taper)
+
+	# average the 2D MTF over rings of equal frequency, one bin per n-th of a cycle per pixel
+	spectrum = np.abs(np.fft.rfft2(psf, (n, n)))
+	radius = np.rint(np.hypot(np.fft.fftfreq(n)[:, None], np.fft.rfftfreq(n)[None, :]) * n).astype(int)
+	bins = n // 2 + 1
+	inside = (radius < bins).ravel()
+	index = (np.arange(images)[:, None] * bins + radius.ravel()[None, inside]).ravel()
+	total = np.bincount(index, weights=spectrum.reshape(images, -1)[:, inside].ravel(), minlength=images * bins)
+	count = np.bincount(radius.ravel()[inside], minlength=bins)
+	m = total.reshape(images, bins) / count
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		m = m / np.max(m, axis=-1, keepdims=True)
+	f = np.arange(bins) / (n * scale)
+
+	return f, (m[0] if single else m)
+
+def mtf50(f, m):
+	"""frequency at which the MTF falls to half
+	f50 = mtf50(f, m) returns the frequency at which the MTF m from mtf (for an
+	image or a stack) first falls below 0.5, interpolated between the frequencies
+	f either side, or nan if it never does."""
+
+	m = np.asarray(m, dtype=float)
+	f = np.asarray(f, dtype=float)
+
+	# first frequency below half, and the one before it
+	below = m < 0.5
+	k = np.clip(np.argmax(below, axis=-1), 1, m.shape[-1] - 1)[..., None]
+	m0, m1 = np.take_along_axis(m, k - 1, axis=-1)[..., 0], np.take_along_axis(m, k, axis=-1)[..., 0]
+	f0, f1 = f[k[..., 0] - 1], f[k[..., 0]]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		f50 = f0 + (m0 - 0.5) / (m0 - m1) * (f1 - f0)
+	f50 = np.where(below[..., 0], f[0], f50)
+
+	return np.where(np.any(below, axis=-1), f50, np.nan)[()]
+
+def _stack(x):
+	"""view a single image as a stack of one image, and note if it was single"""
+
+	x = np.asarray(x)
+	if x.ndim == 2:
+		return x[None, :, :], True
+	elif x.ndim != 3:
+		raise ValueError('input must be an image or a stack of images')
+
+	return x, False
@@ -12,11 +12,19 @@ def phantom(ellipses, n):
 	if len(ellipses.shape) == 1:
 		ellipses = np.array([ellipses])
 
-	phantom_instance = np.zeros((n, n))
-
 	xax = np.linspace(-1.0, 1.0, n, endpoint=True)
 	xg = np.matlib.repmat(xax, n, 1) # x coordinates, the y coordinates are rot90(xg)
 
+	phantom_instance = ellipse_values(ellipses, xg, np.rot90(xg))
+
+	return phantom_instance
+
+def ellipse_values(ellipses, x, y):
+	"""sum of the amplitudes of the ellipses (ellipses x 6) containing each of
+	the points (x, y), as drawn by phantom"""
+
+	values_sum = np.zeros(np.shape(x))
+
 	for ellipse in ellipses:
 		asq = ellipse[1] ** 2       # a^2
 		bsq = ellipse[2] ** 2       # b^2
@@ -24,17 +32,15 @@ def phantom(ellipses, n):
 		x0 = ellipse[3]          # x offset
 		y0 = ellipse[4]          # y offset
 		a = ellipse[0]           # Amplitude change for this ellipse
-		x_center = xg - x0                # Center the ellipse
-		y_center = np.rot90(xg) - y0
+		x_center = x - x0                # Center the ellipse
+		y_center = y - y0
 		cosp = math.cos(phi)
 		sinp = math.sin(phi)
 		values = (((x_center * cosp + y_center * sinp) ** 2) / asq + ((y_center *cosp - x_center * sinp) ** 2) / bsq)
 
-		for index, element in np.ndenumerate(values):
-				if element <= 1:
-					phantom_instance[index] = phantom_instance[index] + a
+		values_sum[values <= 1] += a
 
-	return phantom_instance
+	return values_sum
 	
 def ct_phantom(names, n, type, metal=None):
 
@@ -60,8 +66,92 @@ def ct_phantom(names, n, type, metal=None):
 
 		The output x has data values which correspond to indices in the names
 		array, which must also contain 'Air', 'Adipose', 'Soft Tissue' and 'Bone'.
+
+		The phantom is drawn from the steps given by phantom_steps.
 	"""  
 
+	x = np.zeros((n, n))
+
+	for step in phantom_steps(names, n, type, metal):
+		if step[0] == 'add':
+			x = x + phantom(step[1], n)
+		elif step[0] == 'set':
+			x[step_mask(x, step[1], step[2])] = step[3]
+		elif step[0] == 'points':
+			for row, col in step[1]:
+				x[row][col] = step[2]
+
+	x = np.flipud(x)
+	
+	return x
+
+def ct_phantom_fractions(names, n, type, metal=None, supersample=4):
+
+	""" ct_phantom_fractions create a partial-volume CT phantom
+		f = ct_phantom_fractions(names, n, type, metal) creates the same
+		phantom as ct_phantom(names, n, type, metal), but as the fraction of
+		each pixel filled by each material, so edges are not aliased. f is of
+		size (len(names) x n x n), of type uint8, with 255 for a pixel filled
+		by a material, and can be given to ct_scan in place of the phantom.
+
+		Each pixel is divided into (supersample x supersample) points, and the
+		material at each is found by following phantom_steps, as ct_phantom
+		does for the pixel centres. Single pixel points, as in types 2 and 8,
+		fill the whole pixel. The fractions of each pixel always sum to 255.
+	"""
+
+	steps = phantom_steps(names, n, type, metal)
+	counts = np.zeros((len(names), n, n), dtype=np.uint16)
+
+	# points within each pixel, in pixels from its centre
+	offsets = (np.arange(supersample) + 0.5) / supersample - 0.5
+	xax = np.linspace(-1.0, 1.0, n, endpoint=True)
+	spacing = 2.0 / (n - 1)
+
+	for dy in offsets:
+		for dx in offsets:
+			# x along the columns, and y up the rows, before the final flip
+			x0, y0 = np.meshgrid(xax + dx * spacing, xax[::-1] - dy * spacing)
+			x = np.zeros((n, n))
+			for step in steps:
+				if step[0] == 'add':
+					x = x + ellipse_values(np.array(step[1], ndmin=2), x0, y0)
+				elif step[0] == 'set':
+					x[step_mask(x, step[1], step[2])] = step[3]
+				elif step[0] == 'points':
+					for row, col in step[1]:
+						x[row][col] = step[2]
+
+			for m in np.unique(x).astype(int):
+				counts[m] += (x == m)
+
+	fractions = np.rint(counts * (255.0 / supersample ** 2)).astype(np.int16)
+
+	# give any rounding remainder to the largest fraction, so every pixel sums to 255
+	largest = np.argmax(fractions, axis=0)[None, :, :]
+	remainder = 255 - np.sum(fractions, axis=0)[None, :, :]
+	np.put_along_axis(fractions, largest, np.take_along_axis(fractions, largest, axis=0) + remainder, axis=0)
+	fractions = fractions.astype(np.uint8)
+
+	return fractions[:, ::-1, :].copy()
+
+def phantom_steps(names, n, type, metal=None):
+
+	""" phantom_steps the steps which draw a CT phantom
+		steps = phantom_steps(names, n, type, metal) returns the list of steps
+		which ct_phantom(names, n, type, metal) follows to draw the phantom,
+		starting from zeros. Each step is one of:
+
+		('add', ellipses) - add the amplitude of each ellipse, as for phantom
+		('set', comparison, value, index) - set anything 'ge', 'gt' or 'eq' to
+		value to the material index
+		('points', points, index) - set the (row, col) pixels to the material index
+
+		The points are given before the final flip of ct_phantom. The same steps
+		can be followed along each ray to find exact material path lengths, as in
+		ct_scan_analytic.
+	"""
+
 	# Get material locations
 	air = names.index('Air')
 	adipose =  names.index('Adipose')
@@ -82,33 +172,26 @@ def ct_phantom(names, n, type, metal=None):
 
 		# simple circle for looking at calibration
 		t = [1, 0.8, 0.8, 0.0, 0.0, 0]
-		x = phantom(t, n)
-
-		for index, value in np.ndenumerate(x):
-			if value >= 1:
-				x[index] = tissue
+		steps = [('add', t), ('set', 'ge', 1, tissue)]
 
 	elif type == 2:
 		
 		# impulse for looking at resolution
-		x = np.zeros((n, n))
-		x[int(n / 2)][int(n / 2)] = tissue
+		steps = [('points', [(int(n / 2), int(n / 2))], tissue)]
 		
 	elif type == 8:
 
 		# resolution phantom
 		t = [1, 0.8, 0.8, 0.0, 0.0, 0]
-		x = phantom(t, n)
-
-		for index, value in np.ndenumerate(x):
-			if value >= 1:
-				x[index] = tissue
+		steps = [('add', t), ('set', 'ge', 1, tissue)]
 
+		points = []
 		for r in np.arange(n * 0.04, n * 0.4, n * 0.04):
 			angles = np.cumsum(np.arange(0, 2*math.pi, n * 0.002 / r))
 			angles = angles[angles < (math.pi * 2)]
 			for a in angles:
-				x[int(round(n / 2 + r * math. cos(a)))][int(round(n / 2 + r * math.sin(a)))] = nmetal
+				points.append((int(round(n / 2 + r * math. cos(a))), int(round(n / 2 + r * math.sin(a)))))
+		steps.append(('points', points, nmetal))
 		
 	else:
 		
@@ -116,31 +199,19 @@ def ct_phantom(names, n, type, metal=None):
 		t =  [[1, 0.57, 0.52, -0.35, 0.1, 0],
 				[1, 0.57, 0.52, 0.35, 0.1, 0],
 				[1, 0.52, 0.45, 0, -0.08, 0]]
-		x = phantom(t, n)
-
-		for index, value in np.ndenumerate(x):
-			if value >= 1:
-				x[index] = tissue
+		steps = [('add', t), ('set', 'ge', 1, tissue)]
 
 		a = [[1, 0.55, 0.5, -0.35, 0.1, 0],
 			[1, 0.55, 0.5, 0.35, 0.1, 0],
 			[1, 0.5, 0.43, 0, -0.08, 0]]
-		x = x + phantom(a, n)
-
-		for index, value in np.ndenumerate(x):
-			if value > tissue:
-				x[index] = adipose
+		steps += [('add', a), ('set', 'gt', tissue, adipose)]
 
 		t =  [[1, 0.37, 0.35, -0.42, 0.03, 0],
 			[1, 0.37, 0.35, 0.42, 0.03, 0],
 			[1, 0.24, 0.16, -0.3, 0.28, 20],
 			[1, 0.24, 0.16, 0.3, 0.28, -20],
 			[1, 0.4, 0.2, 0, -0.15, 0]]
-		x = x + phantom(t, n)
-
-		for index, value in np.ndenumerate(x):
-			if value > adipose:
-				x[index] = tissue
+		steps += [('add', t), ('set', 'gt', adipose, tissue)]
 
 		b = [[1, 0.16, 0.12, -0.54, -0.01, 0],
 			[-1, 0.11, 0.10, -0.53, -0.01, 0],
@@ -154,11 +225,7 @@ def ct_phantom(names, n, type, metal=None):
 			[-1, 0.07, 0.06, 0.25, 0.25, -140],
 			[1, 0.18, 0.05, 0.05, -0.15, -100],
 			[-1, 0.14, 0.03, 0.05, -0.15, -100]]
-		x = x + phantom(b, n)
-
-		for index, value in np.ndenumerate(x):
-			if value > tissue:
-				x[index] = bone
+		steps += [('add', b), ('set', 'gt', tissue, bone)]
 		
 		# this adds a metal implant
 		if nmetal > tissue:
@@ -187,17 +254,20 @@ def ct_phantom(names, n, type, metal=None):
 					[100, 0.025, 0.025, -0.3, 0.25, 0],
 					[100, 0.025, 0.025, -0.2, 0.25, 0]]
 			
-			x = x + phantom(m, n)
-
-			for index, value in np.ndenumerate(x):
-				if value > bone:
-					x[index] = nmetal
+			steps += [('add', m), ('set', 'gt', bone, nmetal)]
 
 	# make sure the remainder is set to air
-	for index, value in np.ndenumerate(x):
-		if value == 0:
-			x[index] = air
+	steps.append(('set', 'eq', 0, air))
 
-	x = np.flipud(x)
-	
-	return x
\ No newline at end of file
+	return steps
+
+def step_mask(x, comparison, value):
+	"""where x compares to value, for a 'set' step of phantom_steps"""
+
+	if comparison == 'ge':
+		return x >= value
+	elif comparison == 'gt':
+		return x > value
+	elif comparison == 'eq':
+		return x == value
+	raise ValueError('unknown comparison ' + comparison)
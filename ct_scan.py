@@ -2,10 +2,13 @@ import numpy as np
 import scipy
 from scipy import ndimage
 from ct_detect import ct_detect
+from ct_kernels import get_backend, rotate_sum
+from ct_memory import instrument
 import math
 import sys
 
-def ct_scan(photons, material, phantom, scale, angles, mas=10000):
+@instrument('ct_scan')
+def ct_scan(photons, material, phantom, scale, angles, mas=10000, out=None, projector='interpolate', samples=None, spacing=1, radius=None):
 
 	"""simulate CT scanning of an object
 	scan = ct_scan(photons, material, phantom, scale, angles, mas) takes a phantom
@@ -14,42 +17,164 @@ def ct_scan(photons, material, phantom, scale, angles, mas=10000):
 	current-time product mas.
 
 	scale is the pixel size of the input array phantom, in cm per pixel.
+
+	If out is given, such as a ChunkedArray from ct_lib of size (angles x samples),
+	each angle is written into it as it is scanned, and out is returned.
+
+	projector selects how the line integrals are found:
+	'interpolate' - rotate each material image and sum its columns (default)
+	'joseph' - step along each ray a row (or column) at a time, interpolating
+	between the two nearest pixels, so only the pixels on each ray are used and
+	all materials are found together
+
+	The joseph projector also allows samples detectors (default n) with a
+	spacing in pixels (default 1), and fan-beam scans with the source at radius
+	pixels from the centre of rotation. As in Xtreme, the fan samples lie on a
+	flat line through the centre, so a sample at u from the middle is at a fan
+	angle of atan(u / radius). A fan-beam scan has angles views per 180 degrees,
+	and enough extra views to cover the fan angle, as needed for fan to parallel
+	conversion.
+
+	The interpolate projector uses the compiled kernel from ct_kernels when
+	its backend is numba.
+
+	phantom can also be the fractions (materials x n x n) of each pixel filled
+	by each material, as from ct_phantom_fractions, either as uint8 with 255
+	for a full pixel or as floats from 0 to 1. These are used directly as the
+	weight of each material in each pixel, so edges are not aliased.
+
+	photons can also be several source spectra (spectra x energies), such as a
+	list of spectra or from fake_sources, with mas a single value or one for
+	each spectrum. The path lengths through each material are then found once
+	for each angle, and used to find the detections for every spectrum, so
+	scan is of size (spectra x angles x samples), as is out if given.
 	"""
 
+	# several spectra are scanned together, from the same path lengths
+	if isinstance(photons, (list, tuple)):
+		photons = np.array(photons)
+	if isinstance(mas, (list, tuple)):
+		mas = np.array(mas)
+	spectra = () if np.ndim(photons) < 2 else (len(photons),)
+
 	# find the coefficients for air
 	air = material.name.index('Air')
 
 	# get input image dimensions, and create a coordinate structure
-	n = max(phantom.shape)
+	fractions = phantom.ndim == 3
+
+	# uint8 fractions are used as they are, in 255ths of a pixel, and the
+	# depths scaled once they are found, rather than copying each to float
+	unit = 1.0 / 255 if fractions and phantom.dtype == np.uint8 else 1.0
+	n = max(phantom.shape[-2:])
 	xi, yi = np.meshgrid(np.arange(n) - (n/2) + 0.5, np.arange(n) - (n/2) + 0.5)
 
-	# check which materials phantom actually contains, and create single
-	# material phantoms for each of these, except for air
-	materials = []
-	material_phantom = []
-	for m in range(0,len(material.coeffs)):
-		z0 = (phantom == m).astype(float)
-		if (m != air) & (z0.sum()>0):
-			materials.append(m)
-			material_phantom.append(z0)
+	if projector == 'interpolate':
+		if samples is not None or spacing != 1 or radius is not None:
+			raise ValueError('samples, spacing and radius are only supported by the joseph projector')
+
+		# check which materials phantom actually contains, and create single
+		# material phantoms for each of these, except for air
+		materials = []
+		material_phantom = []
+		material_box = []
+		for m in range(0,len(material.coeffs)):
+			if fractions:
+				if (m == air) or not phantom[m].any():
+					continue
+				z0 = phantom[m] if phantom.dtype == np.uint8 else np.asarray(phantom[m], dtype=float)
+			else:
+				z0 = (phantom == m).astype(float)
+			if (m != air) & (z0.sum()>0):
+				materials.append(m)
+
+				# keep only the bounding box, with a margin of zeros, of any
+				# material covering a small part of the image
+				rows = np.flatnonzero(z0.any(axis=1))
+				cols = np.flatnonzero(z0.any(axis=0))
+				r0, r1 = max(rows[0] - 1, 0), min(rows[-1] + 2, n)
+				c0, c1 = max(cols[0] - 1, 0), min(cols[-1] + 2, n)
+				if (r1 - r0) * (c1 - c0) * 4 < n * n:
+					material_phantom.append(z0[r0:r1, c0:c1])
+					material_box.append((r0, c0))
+				elif get_backend() == 'numba':
+					# the compiled kernel needs floats, so convert once here
+					material_phantom.append(np.asarray(z0, dtype=float))
+					material_box.append(None)
+				else:
+					material_phantom.append(z0)
+					material_box.append(None)
+
+	elif projector == 'joseph':
+		if fractions:
+			labels = phantom if phantom.dtype == np.uint8 else np.asarray(phantom, dtype=float)
+		else:
+			labels = phantom.astype(int)
+
+	else:
+		raise ValueError('unknown projector ' + str(projector))
+
+	# detector positions, in pixels from the centre
+	if samples is None:
+		samples = n
+	u = (np.arange(samples) - (samples/2) + 0.5) * spacing
+
+	# fan-beam scans need extra views to cover the fan angle
+	views = angles
+	if radius is not None:
+		views = angles + int(math.ceil(2 * math.atan(np.max(np.abs(u)) / radius) / (math.pi / angles)))
 
 	# scan one angle at a time
-	scan = np.zeros((angles, n))
-	for angle in range(angles):
+	if out is None:
+		scan = np.zeros(spectra + (views, samples))
+	else:
+		scan = out
+	for angle in range(views):
 
 		sys.stdout.write("Scanning angle: %d   \r" % (angle + 1) )
 
-		# Get rotated coordinates for interpolation
 		p = -math.pi / 2 - angle * math.pi / angles
-		x0 = xi * math.cos(p) - yi * math.sin(p) + (n/2) - 0.5
-		y0 = xi * math.sin(p) + yi * math.cos(p) + (n/2) - 0.5
 
-		# For each material, add up how many pixels contain this on each ray
-		depth = np.zeros((len(material.coeffs), n))
+		if projector == 'interpolate':
+			# For each material, add up how many pixels contain this on each ray
+			depth = np.zeros((len(material.coeffs), n))
+
+			# small materials only need the rays through their bounding box
+			for index, m in enumerate(materials):
+				if material_box[index] is not None:
+					depth[m] = box_sum(material_phantom[index], material_box[index], n, p)
+
+			full = [index for index, box in enumerate(material_box) if box is None]
+			if get_backend() == 'numba':
+				# the compiled kernel forms the coordinates as it goes
+				for index in full:
+					depth[materials[index]] = rotate_sum(material_phantom[index], p)
+			elif len(full) > 0:
+				# Get rotated coordinates for interpolation
+				x0 = xi * math.cos(p) - yi * math.sin(p) + (n/2) - 0.5
+				y0 = xi * math.sin(p) + yi * math.cos(p) + (n/2) - 0.5
+
+				for index in full:
+					interpolated = scipy.ndimage.map_coordinates(material_phantom[index], [y0, x0], output=float, order=1, mode='constant', cval=0, prefilter=False)
+					depth[materials[index]] = np.sum(interpolated, axis=0)
+
+		else:
+			# form the rays, as a point on each and a unit direction, in (col, row)
+			across = np.array([math.cos(p), math.sin(p)])
+			along = np.array([-math.sin(p), math.cos(p)])
+			centre = (n - 1) / 2
+			origin = centre + u[:, None] * across[None, :]
+			if radius is None:
+				direction = np.tile(along, (samples, 1))
+			else:
+				direction = origin - (centre - radius * along)
+				direction /= np.sqrt(np.sum(direction ** 2, axis=1))[:, None]
+
+			depth = joseph_depth(labels, origin, direction, len(material.coeffs))
+			depth[air] = 0
 
-		for index, m in enumerate(materials):
-			interpolated = scipy.ndimage.map_coordinates(material_phantom[index], [y0, x0], order=1, mode='constant', cval=0, prefilter=False)
-			depth[m] = np.sum(interpolated, axis=0)
+		if unit != 1:
+			depth *= unit
 
 		# only necessary for more complex forms of interpolation above
 		depth = np.clip(depth, 0, None)
@@ -62,9 +187,106 @@ def ct_scan(photons, material, phantom, scale, angles, mas=10000):
 		# scale the depth appropriately and calculate detections for this set of
 		# materials
 		depth*= scale
-	
-		scan[angle] = ct_detect(photons, material.coeffs, depth, mas)
-	
+
+		scan[..., angle, :] = ct_detect(photons, material.coeffs, depth, mas)
+
 	sys.stdout.write("\n")
 
-	return scan
\ No newline at end of file
+	return scan
+
+def box_sum(image, corner, n, p):
+
+	"""column sums of the rotated image, for part of an image
+	depth = box_sum(image, corner, n, p) returns the same (n) sums as the
+	interpolate projector of ct_scan finds by rotating an (n x n) image by p,
+	for an image which is zero except for the box image whose top left pixel
+	is at corner (row, col). Only the points of the rotated grid which fall in
+	the box are interpolated, so the cost scales with the area of the box.
+	The box should have a margin of zeros, unless it is at the image edge."""
+
+	h = (n/2) - 0.5
+	c, s = math.cos(p), math.sin(p)
+
+	# positions of the box corners on the rotated grid, which bound the grid
+	# rows and columns that can fall inside it
+	y, x = np.meshgrid([corner[0], corner[0] + image.shape[0] - 1], [corner[1], corner[1] + image.shape[1] - 1])
+	u = (x - h) * c + (y - h) * s + h
+	v = (y - h) * c - (x - h) * s + h
+	j0, j1 = max(int(math.floor(u.min())), 0), min(int(math.ceil(u.max())), n - 1)
+	i0, i1 = max(int(math.floor(v.min())), 0), min(int(math.ceil(v.max())), n - 1)
+
+	depth = np.zeros(n)
+	if j1 < j0 or i1 < i0:
+		return depth
+
+	# rotated coordinates of that part of the grid, relative to the box
+	xi, yi = np.meshgrid(np.arange(j0, j1 + 1) - h, np.arange(i0, i1 + 1) - h)
+	x0 = xi * c - yi * s + h - corner[1]
+	y0 = xi * s + yi * c + h - corner[0]
+
+	interpolated = scipy.ndimage.map_coordinates(image, [y0, x0], output=float, order=1, mode='constant', cval=0, prefilter=False)
+	depth[j0:j1 + 1] = np.sum(interpolated, axis=0)
+
+	return depth
+
+def joseph_depth(labels, origin, direction, materials):
+
+	"""path length of rays through each material using Joseph's method
+	depth = joseph_depth(labels, origin, direction, materials) returns the length
+	in pixels (materials x rays) of each ray through each material of the image of
+	material indices labels (n x n). Each ray passes through the point origin
+	(rays x 2) with unit direction (rays x 2), both given as (col, row). labels
+	can also be the fraction of each pixel filled by each material (materials x
+	n x n), as floats.
+
+	Each ray steps one row at a time if it is closer to the rows than to the
+	columns, or otherwise one column at a time, interpolating linearly between
+	the two nearest pixels, and each step is weighted by its length."""
+
+	n = labels.shape[-1]
+	rays = len(origin)
+	if labels.ndim == 3:
+		present = [m for m in range(materials) if labels[m].any()]
+	depth = np.zeros((materials, rays))
+
+	# axis 1 steps along rows, axis 0 along columns
+	for axis in (1, 0):
+		if axis == 1:
+			index = np.flatnonzero(np.abs(direction[:, 1]) >= np.abs(direction[:, 0]))
+		else:
+			index = np.flatnonzero(np.abs(direction[:, 0]) > np.abs(direction[:, 1]))
+		if len(index) == 0:
+			continue
+
+		# position in the other axis at each step, and the length of each step
+		o, d = origin[index], direction[index]
+		steps = np.arange(n)
+		other = o[:, 1 - axis, None] + (steps[None, :] - o[:, axis, None]) * (d[:, 1 - axis] / d[:, axis])[:, None]
+		length = 1 / np.abs(d[:, axis])
+		low = np.floor(other).astype(int)
+		fraction = other - low
+
+		# share each step between the two nearest pixels, by material
+		ray = np.arange(len(index))[:, None]
+		total = np.zeros(materials * len(index))
+		for pixel, weight in ((low, 1 - fraction), (low + 1, fraction)):
+			valid = (pixel >= 0) & (pixel < n)
+			pixel = np.clip(pixel, 0, n - 1)
+			if labels.ndim == 3:
+				# add each material's fraction of the pixels instead
+				weight = np.where(valid, weight, 0)
+				for m in present:
+					if axis == 1:
+						value = labels[m][steps[None, :], pixel]
+					else:
+						value = labels[m][pixel, steps[None, :]]
+					total[m * len(index):(m + 1) * len(index)] += np.sum(value * weight, axis=1)
+				continue
+			if axis == 1:
+				label = labels[steps[None, :], pixel]
+			else:
+				label = labels[pixel, steps[None, :]]
+			total += np.bincount((label * len(index) + ray).ravel(), weights=np.where(valid, weight, 0).ravel(), minlength=materials * len(index))
+		depth[:, index] += total.reshape(materials, len(index)) * length[None, :]
+
+	return depth
@@ -0,0 +1,138 @@
+import numpy as np
+import math
+import sys
+from ct_detect import ct_detect
+from ct_phantom import phantom_steps, step_mask
+
+def ct_scan_analytic(photons, material, type, n, scale, angles, mas=10000, metal=None):
+
+	"""simulate CT scanning of an ellipse phantom without rasterising it
+	scan = ct_scan_analytic(photons, material, type, n, scale, angles, mas, metal)
+	scans the phantom ct_phantom(material.name, n, type, metal) in the same
+	geometry as ct_scan, but with the exact path length of each ray through
+	each material, found from the ellipses that define the phantom.
+
+	scale is the pixel size of the phantom, in cm per pixel.
+
+	Each ray is split into segments at the edges of every ellipse, and the
+	material of each segment is found by following the phantom_steps that
+	ct_phantom uses, so material precedence is the same. The cost is of order
+	angles x samples x ellipses, rather than angles x samples^2 for ct_scan.
+	Single pixels, as in types 2 and 8, are taken as discs of one pixel area.
+	"""
+
+	# find the coefficients for air
+	air = material.name.index('Air')
+
+	depths = analytic_depth(phantom_steps(material.name, n, type, metal), n, angles, len(material.coeffs))
+
+	scan = np.zeros((angles, n))
+	for angle in range(angles):
+
+		sys.stdout.write("Scanning angle: %d   \r" % (angle + 1) )
+
+		depth = depths[angle]
+
+		# air within the phantom, between the ellipses, is counted again below
+		depth[air] = 0
+
+		# ensure an appropriate amount of air is included in the calculation
+		# to account for the scan being circular, but the phantom being square
+		# diameter of circle taken to be twice the phantom side length
+		depth[air] = 2 * n - np.sum(depth, axis=0)
+
+		# scale the depth appropriately and calculate detections for this set of
+		# materials
+		depth*= scale
+
+		scan[angle] = ct_detect(photons, material.coeffs, depth, mas)
+
+	sys.stdout.write("\n")
+
+	return scan
+
+def analytic_depth(steps, n, angles, materials):
+
+	"""exact material path lengths through a phantom, in pixels
+	depth = analytic_depth(steps, n, angles, materials) returns the length of each
+	ray (angles x materials x samples) through each material of the phantom of
+	size n described by steps, as from phantom_steps, in the geometry of ct_scan.
+	Air outside of all the ellipses is not included."""
+
+	# spacing of the phantom coordinates (-1 to 1) per pixel, and pixel area discs
+	s = 2 / (n - 1)
+	radius = s / math.sqrt(math.pi)
+
+	# gather every ellipse, with the step it belongs to
+	ellipses, owner = [], []
+	for k, step in enumerate(steps):
+		if step[0] == 'add':
+			e = np.array(step[1], dtype=float).reshape(-1, 6)
+		elif step[0] == 'points':
+			# pixel (row, col) before the flip is at x = col, y = -row
+			p = np.array(step[1], dtype=float).reshape(-1, 2)
+			e = np.column_stack((np.ones(len(p)), np.full(len(p), radius), np.full(len(p), radius),
+				-1 + p[:, 1] * s, 1 - p[:, 0] * s, np.zeros(len(p))))
+		else:
+			continue
+		ellipses.append(e)
+		owner.append(np.full(len(e), k))
+	ellipses = np.concatenate(ellipses) if ellipses else np.zeros((0, 6))
+	owner = np.concatenate(owner) if owner else np.zeros(0, dtype=int)
+
+	amplitude, a, b, x0, y0 = ellipses[:, 0], ellipses[:, 1], ellipses[:, 2], ellipses[:, 3], ellipses[:, 4]
+	phi = ellipses[:, 5] * math.pi / 180
+
+	# detector positions, in pixels from the centre
+	u = (np.arange(n) - (n/2) + 0.5)[:, None]
+
+	depth = np.zeros((angles, materials, n))
+	for angle in range(angles):
+
+		# each ray is s * (u cos p - v sin p, u sin p + v cos p) for v in pixels,
+		# which in each ellipse's frame is (X0 + v DX, Y0 + v DY)
+		p = -math.pi / 2 - angle * math.pi / angles
+		xc, yc = s * u * math.cos(p) - x0, s * u * math.sin(p) - y0
+		X0 = xc * np.cos(phi) + yc * np.sin(phi)
+		Y0 = yc * np.cos(phi) - xc * np.sin(phi)
+		DX = s * np.sin(phi - p)
+		DY = s * np.cos(phi - p)
+
+		# solve for the entry and exit of each ray and ellipse
+		A = DX ** 2 / a ** 2 + DY ** 2 / b ** 2
+		B = 2 * (X0 * DX / a ** 2 + Y0 * DY / b ** 2)
+		C = X0 ** 2 / a ** 2 + Y0 ** 2 / b ** 2 - 1
+		disc = B ** 2 - 4 * A * C
+		hit = disc > 0
+		root = np.sqrt(np.where(hit, disc, 0))
+		far = 4.0 * n
+		v1 = np.where(hit, (-B - root) / (2 * A), far)
+		v2 = np.where(hit, (-B + root) / (2 * A), far)
+
+		# sort the edges along each ray, and sum the amplitude changes for each
+		# step to find its value on each segment between edges
+		v = np.concatenate((v1, v2), axis=1)
+		order = np.argsort(v, axis=1)
+		v = np.take_along_axis(v, order, axis=1)
+		length = np.diff(v, axis=1)
+		length[v[:, 1:] >= far] = 0
+		change = np.concatenate((np.where(hit, amplitude, 0), np.where(hit, -amplitude, 0)), axis=1)
+		change = np.take_along_axis(change, order, axis=1)
+		step_of = np.concatenate((owner, owner))[order]
+
+		# follow the phantom steps on every segment
+		x = np.zeros(length.shape)
+		for k, step in enumerate(steps):
+			if step[0] == 'add':
+				x = x + np.cumsum(np.where(step_of == k, change, 0), axis=1)[:, :-1]
+			elif step[0] == 'points':
+				inside = np.cumsum(np.where(step_of == k, change, 0), axis=1)[:, :-1]
+				x = np.where(inside > 0, step[2], x)
+			else:
+				x = np.where(step_mask(x, step[1], step[2]), step[3], x)
+
+		# add up the length in each material
+		for m in np.unique(x):
+			depth[angle, int(m)] = np.sum(np.where(x == m, length, 0), axis=1)
+
+	return depth
@@ -0,0 +1,181 @@
+import numpy as np
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import sys
+import tempfile
+from material import Material
+from source import Source
+from ct_phantom import ct_phantom
+from ct_lib import get_full_path
+from ct_metrics import rmse, ssim, roi_statistics
+from scan_and_reconstruct import scan_and_reconstruct
+
+# default settings for any parameter not given in a sweep grid
+sweep_defaults = {'type': 1, 'n': 128, 'angles': 128, 'scale': 0.01, 'spectrum': '100kVp, 3mm Al',
+	'mas': 10000, 'alpha': 0.001, 'correct': True, 'metal': None}
+
+# modules whose code a sweep point depends on, which are part of its key
+sweep_modules = ['ct_sweep', 'ct_phantom', 'ct_scan', 'ct_detect', 'attenuate', 'ct_calibrate', 'ramp_filter',
+	'back_project', 'ct_kernels', 'hu', 'ct_metrics', 'scan_and_reconstruct', 'material', 'source', 'fake_source']
+
+# material data for each worker process, loaded once by _initialise
+_material = None
+
+def ct_sweep(grid, storage_directory='results/sweep', processes=None):
+
+	""" ct_sweep run a parameter sweep of simulated scans and reconstructions
+	records = ct_sweep(grid) runs scan_and_reconstruct for every combination of
+	the settings in grid, a dictionary from setting name to a list of values, for
+	example {'type': [1, 3], 'n': [128, 256], 'alpha': [0.001, 0.1]}. The settings
+	are those in sweep_defaults: phantom type, n, angles, scale, spectrum, mas, alpha,
+	correct and metal. A spectrum is either a Source name or an array of photons.
+	grid can also be a list of such dictionaries, whose grids are all run.
+
+	The points are run on a pool of processes (processes defaults to the number of
+	CPUs). Each point is identified by a hash of its settings and of the photons
+	and material coefficients it uses, and its reconstruction (in HU) and metrics
+	are stored in storage_directory as <hash>.npz and <hash>.json. Points which are
+	already stored are not run again, so extending a grid only runs the new points.
+
+	The returned records are a list of dictionaries, one per point in grid order,
+	holding the settings, the hash 'key' and the metrics 'rmse', 'ssim' (both
+	against the phantom attenuation in HU) and 'mean' and 'std' (HU of each
+	material in the phantom, by name)."""
+
+	material = Material()
+	source = Source()
+
+	# expand the grid into a list of settings, with resolved photons
+	points = []
+	for g in (grid if isinstance(grid, list) else [grid]):
+		names = list(g.keys())
+		for unknown in set(names) - set(sweep_defaults):
+			raise KeyError('Unknown sweep setting ' + unknown + '. Acceptable settings include: ' + str(list(sweep_defaults)))
+		for values in itertools.product(*[g[name] for name in names]):
+			settings = dict(sweep_defaults)
+			settings.update(zip(names, values))
+			photons = settings['spectrum']
+			if isinstance(photons, str):
+				photons = source.photon(photons)
+			photons = np.asarray(photons, dtype=float)
+			points.append((settings, photons, _key(settings, photons, material)))
+
+	# run only the points which are not already stored
+	get_full_path(storage_directory, '')
+	todo = {}
+	for settings, photons, key in points:
+		if key not in todo and not os.path.exists(os.path.join(storage_directory, key + '.json')):
+			todo[key] = (settings, photons)
+
+	print('Sweep of %d points, %d already stored, running %d' % (len(points), len(points) - len(todo), len(todo)))
+
+	if len(todo) > 0:
+		with concurrent.futures.ProcessPoolExecutor(processes, initializer=_initialise) as pool:
+			futures = [pool.submit(_run, settings, photons, key, storage_directory) for key, (settings, photons) in todo.items()]
+			for future in concurrent.futures.as_completed(futures):
+				# raise any error from the worker
+				future.result()
+
+	# gather the stored records in grid order
+	records = []
+	for settings, photons, key in points:
+		with open(os.path.join(storage_directory, key + '.json')) as f:
+			records.append(json.load(f))
+
+	return records
+
+def load_sweep(storage_directory, key):
+	"""load the stored reconstruction (samples x samples, in HU) for a sweep point"""
+
+	with np.load(os.path.join(storage_directory, key + '.npz')) as data:
+		return data['reconstruction']
+
+def _key(settings, photons, material):
+	"""content hash of the settings and the data a sweep point uses"""
+
+	h = hashlib.sha256()
+	h.update(json.dumps({name: value for name, value in settings.items() if name != 'spectrum'}, sort_keys=True, default=_json_value).encode())
+	h.update(photons.tobytes())
+	h.update(np.ascontiguousarray(material.coeffs, dtype=float).tobytes())
+	h.update(json.dumps(material.name).encode())
+	h.update(_code_version().encode())
+
+	return h.hexdigest()[:32]
+
+def _code_version():
+	"""hash of the source of the sweep_modules, so that stored points are run
+	again once any of the code they depend on has changed"""
+
+	h = hashlib.sha256()
+	for name in sweep_modules:
+		__import__(name)
+		with open(sys.modules[name].__file__, 'rb') as f:
+			h.update(f.read())
+
+	return h.hexdigest()[:16]
+
+def _json_value(value):
+	"""plain python value of a numpy scalar or array in settings, for json"""
+
+	if isinstance(value, (np.generic, np.ndarray)):
+		return value.tolist()
+	raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+def _initialise():
+	"""load the material data once in each worker process"""
+
+	global _material
+	_material = Material()
+
+def _run(settings, photons, key, storage_directory):
+	"""run and store a single sweep point"""
+
+	material = _material if _material is not None else Material()
+
+	# seed the noise from the key so that each point is repeatable
+	np.random.seed(int(key[:8], 16))
+
+	p = ct_phantom(material.name, settings['n'], settings['type'], metal=settings['metal'])
+	y = scan_and_reconstruct(photons, material, p, settings['scale'], settings['angles'],
+		settings['mas'], settings['alpha'], settings['correct'])
+
+	# phantom attenuation in HU at the peak source energy
+	e = np.argmax(photons)
+	water = material.coeff('Water')[e]
+	p_mu = material.coeffs[p.astype(int), e]
+	p_hu = np.clip(1000 * (p_mu - water) / water, -1024, 3071)
+
+	# metrics against the phantom, inside the reconstruction circle
+	n = settings['n']
+	xi, yi = np.meshgrid(np.arange(n) - (n/2) + 0.5, np.arange(n) - (n/2) + 0.5)
+	outside = (xi ** 2 + yi ** 2) > (n/2) ** 2
+
+	# statistics only of the materials within the circle, with the pixels
+	# outside given a label of their own which is left out
+	indices = np.unique(p[~outside]).astype(int)
+	labels = np.where(outside, len(material.name), p)
+	mean, std, count = roi_statistics(y, labels, indices)
+	record = {name: value for name, value in settings.items() if name != 'spectrum'}
+	record['spectrum'] = settings['spectrum'] if isinstance(settings['spectrum'], str) else 'custom'
+	record['key'] = key
+	record['code_version'] = _code_version()
+	record['rmse'] = float(rmse(np.where(outside, p_hu, y), p_hu))
+	record['ssim'] = float(ssim(np.interp(y, (-1024, 3071), (0, 255)), np.interp(p_hu, (-1024, 3071), (0, 255))))
+	record['mean'] = {material.name[i]: float(m) for i, m in zip(indices, mean)}
+	record['std'] = {material.name[i]: float(s) for i, s in zip(indices, std)}
+
+	# write the arrays before the record, so a stored record is always complete,
+	# each through a temporary file of its own, as other sweeps may be writing
+	# to the same directory
+	full_path = os.path.join(storage_directory, key)
+	with tempfile.NamedTemporaryFile(dir=storage_directory, prefix=key, suffix='.npz', delete=False) as f:
+		np.savez_compressed(f, reconstruction=y, phantom=p)
+	os.replace(f.name, full_path + '.npz')
+	with tempfile.NamedTemporaryFile(mode='w', dir=storage_directory, prefix=key, suffix='.json', delete=False) as f:
+		json.dump(record, f, default=_json_value)
+	os.replace(f.name, full_path + '.json')
+
+	return record
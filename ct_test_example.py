@@ -8,6 +8,7 @@ from ct_phantom import *
 from ct_lib import *
 from scan_and_reconstruct import *
 from create_dicom import *
+from ct_metrics import *
 
 # create object instances
 material = Material()
@@ -41,13 +42,23 @@ def test_2():
 	n, angles, scale = 256, 256, 0.01
 	s = source.photon('80kVp, 1mm Al')
 
-	# create a phantom and reconstruction
+	# create a phantom and reconstruction, keeping the attenuation for the MTF
 	p = ct_phantom(material.name, n, 2)
-	y = scan_and_reconstruct(s, material, p, scale, angles)
+	x = scan_and_reconstruct(s, material, p, scale, angles, attenuation=True)
+	y = hu(s, material, x, scale)
 
 	# save some meaningful results
 	save_plot(y[128,:], 'results', 'test_2_plot')
 
+	# and the modulation transfer function, up to the Nyquist frequency
+	f, m = mtf(x, scale)
+	f50 = mtf50(f, m)
+	with open('results/test_2_output.txt', mode='w') as f_out:
+		if np.isnan(f50):
+			f_out.write('MTF stays above 50% up to the Nyquist frequency of ' + str(f[-1]) + ' cycles/cm')
+		else:
+			f_out.write('Frequency at which MTF falls to 50% is ' + str(f50) + ' cycles/cm')
+
 	# the impulse response should of the form of a sharp sinc function
 
 def test_3():
@@ -139,15 +150,8 @@ def test_6(hu=False):
 	p = ct_phantom(material.name, n, 6)
 	y = scan_and_reconstruct(s, material, p, scale, angles)
 
-	# get material coefficients at the source energy
-	mu_E = material.coeffs[:, np.argmax(s)].flatten()
-
-	# convert to HU if reconstruction in HU
-	if hu:
-		mu_E = 1000 * (mu_E - material.coeff('Water')[np.argmax(s)]) / material.coeff('Water')[np.argmax(s)]
-
-	# round each reconstructed value to the nearest material
-	p_reconstruction = np.argmin(np.abs(np.subtract.outer(y, mu_E)), axis=-1)
+	# round each reconstructed value to the nearest material at the source energy
+	p_reconstruction = material.segment(y, material.mev[np.argmax(s)], hu=hu)
 
 	# find areas where the reconstruction identifies the correct materials
 	correct = np.where(p_reconstruction == p, 1, 0)
@@ -170,8 +174,7 @@ def test_7(hu=False):
 
 	# create a phantom and reconstructions
 	p = ct_phantom(material.name, n, 5)
-	y_i = scan_and_reconstruct(s_i, material, p, scale, angles)
-	y_r = scan_and_reconstruct(s_r, material, p, scale, angles)
+	y_i, y_r = scan_and_reconstruct([s_i, s_r], material, p, scale, angles)
 
 	# convert the phantom indices to material coefficients at the source energy
 	p_mu = np.zeros_like(p)
@@ -198,11 +201,8 @@ def test_7(hu=False):
 		y_r = np.interp(y_r, (low, high), (0, 255))
 		p_mu = np.interp(p_mu, (low, high), (0, 255))
 
-	# calculate the SSIM
-	L = 2 ** 8 - 1
-	c1, c2 = (0.01 * L) ** 2, (0.03 * L) ** 2
-	cov = lambda x, y : np.mean((y - np.mean(y)) * (x - np.mean(x)))
-	SSIM = lambda x, y : (2 * np.mean(y) * np.mean(x) + c1) * (2 * cov(x, y) + c2) / ((np.mean(y) ** 2 + np.mean(x) ** 2 + c1) * (np.var(y) + np.var(x) + c2))
+	# calculate the windowed SSIM
+	SSIM = lambda x, y : ssim(x, y, L=2 ** 8 - 1)
 
 	# save some meaningful results
 	with open('results/test_7_output.txt', mode='w') as f:
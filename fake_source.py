@@ -1,6 +1,12 @@
 import numpy as np
+import collections
 import math
 
+# spectra most recently made by fake_sources, by their parameters, with the
+# least recently used dropped once there are more than _spectra_cache_size
+_spectra_cache = collections.OrderedDict()
+_spectra_cache_size = 32
+
 def fake_source(mev, mvp, coeff=None, thickness=0, method='normal'):
 
 	""" fake_source can generate typical CT X-ray source energies
@@ -17,15 +23,74 @@ def fake_source(mev, mvp, coeff=None, thickness=0, method='normal'):
 	for an 'ideal' source with a very narrow energy range."""
 
 	# check for energies
-	energies = len(mev)
+	mev = np.asarray(mev, dtype=float)
+
+	source = _spectra(mev, np.array([mvp], dtype=float), method)[0]
+
+	# add any additional metal filter
+	if coeff is not None:
+		source = source * np.exp(-coeff * thickness / 10)
+
+	return source
+
+def fake_sources(mev, mvp, coeffs=None, thickness=0, method='normal'):
+
+	""" fake_sources generates a family of typical CT X-ray sources at once
+
+	y = fake_sources(mev, mvp, coeffs, thickness) creates a matrix y (spectra x
+	energies) of photons per cm^2 per keV, where row i is the same as
+	fake_source(mev, mvp[i], coeffs[i], thickness[i]). mvp and thickness can be
+	single values or vectors, and coeffs can be None, a single vector of
+	coefficients (energies) or one for each spectrum (spectra x energies), and
+	they are broadcast together, so for example a kVp sweep through a fixed
+	filter, or a filter thickness sweep at fixed kVp, is a single call.
+
+	The result is made for all the spectra at once, and the most recent are
+	cached, so calling this again with the same parameters returns a copy of
+	the same spectra.
+	It can be given directly to ct_detect, which then returns the detections
+	for every spectrum."""
+
+	mev = np.asarray(mev, dtype=float)
+	mvp = np.atleast_1d(np.asarray(mvp, dtype=float))
+	thickness = np.atleast_1d(np.asarray(thickness, dtype=float))
+	if coeffs is not None:
+		coeffs = np.asarray(coeffs, dtype=float)
+		if coeffs.shape[-1] != len(mev):
+			raise ValueError('input coeffs has different number of energies to input mev')
+		coeffs = coeffs.reshape((-1, len(mev)))
+
+	# number of spectra, from all the parameters together
+	spectra = np.broadcast_shapes(mvp.shape, thickness.shape, (1,) if coeffs is None else coeffs.shape[:1])[0]
+
+	key = (method, mev.tobytes(), mvp.tobytes(), thickness.tobytes(), None if coeffs is None else coeffs.tobytes())
+	if key in _spectra_cache:
+		_spectra_cache.move_to_end(key)
+		return _spectra_cache[key].copy()
+
+	source = _spectra(mev, np.broadcast_to(mvp, (spectra,)), method)
+
+	# add any additional metal filters
+	if coeffs is not None:
+		source = source * np.exp(-coeffs * thickness[:, None] / 10)
+
+	_spectra_cache[key] = source
+	if len(_spectra_cache) > _spectra_cache_size:
+		_spectra_cache.popitem(last=False)
+
+	return source.copy()
+
+def _spectra(mev, mvp, method):
+	"""unfiltered spectra (spectra x energies) for each maximum energy in mvp"""
+
+	mvp = mvp[:, None]
 
 	if method == 'ideal':
-	
+
 		# single energy, at about the peak of the broader energy radiation
-		source = np.zeros(energies)
-		m = np.abs(mev - mvp * 0.7)
-		source[np.where(m == np.amin(m))] = 1e10
-	
+		m = np.abs(mev[None, :] - mvp * 0.7)
+		source = np.where(m == np.amin(m, axis=1, keepdims=True), 1e10, 0.0)
+
 	else:
 
 		# experimental function to match expected form of source radiation
@@ -37,17 +102,12 @@ def fake_source(mev, mvp, coeff=None, thickness=0, method='normal'):
 
 		source = (1 / pow((2 * math.pi), 2)) * np.exp(source) * pow(np.abs(mev - offset), (1 / alpha))
 
-		source[np.where(mev>mvp)] = 0
+		source[mev > mvp] = 0
 
-		for index, value in np.ndenumerate(mev):
-			if source[index] != 0 and value > (0.8 * mvp):
-				source[index] = source[index] * pow((mvp - value) / (0.2 * mvp), .3)
+		# roll off towards the maximum energy
+		rolloff = (source != 0) & (mev > (0.8 * mvp))
+		source[rolloff] = source[rolloff] * pow(((mvp - mev) / (0.2 * mvp))[rolloff], .3)
 
 		source = source * 1.5e9
 
-
-	# add any additional metal filter
-	if coeff is not None:
-		source = source * np.exp(-coeff * thickness / 10)
-
-	return source
\ No newline at end of file
+	return source
@@ -9,16 +9,53 @@ def hu(p, material, reconstruction, scale):
 
 	# use water to calibrate
 	n = max(reconstruction.shape)
+	calibration = hu_calibration(p, material, scale, n)
+
+	# use result to convert to hounsfield units
+	# limit minimum to -1024, which is normal for CT data.
+	# this goes through hu_stored, so both round the same way
+	hounsfield = hu_stored(reconstruction, calibration).astype('int') - 1024
+
+	return hounsfield
+
+def hu_calibration(p, material, scale, n):
+	""" reconstructed attenuation of water for Hounsfield Unit conversion
+	calibration = hu_calibration(p, material, scale, n) returns the attenuation
+	that water reconstructs to for photon energy p, material coefficients and
+	scale given, and an image of size n. This only needs computing once for each
+	source and geometry, and can then be reused for every slice."""
+
 	air = material.coeff('Air')
 	water = material.coeff('Water')
-	
+
 	# put this through the same calibration process as the normal CT data
 	calibration = ct_detect(p, np.array((water, air)), scale * n * np.ones((2)))
 	calibration = ct_calibrate(p, material, np.array(calibration, ndmin=2), scale) / (scale * n)
 
-	# use result to convert to hounsfield units
-	# limit minimum to -1024, which is normal for CT data.
-	hounsfield = 1000 * (reconstruction - calibration) / calibration
-	hounsfield = np.clip(hounsfield, -1024, 3071).astype('int')
+	return calibration
+
+def hu_stored(reconstruction, calibration, out=None):
+	""" convert CT reconstruction output directly to DICOM stored values
+	stored = hu_stored(reconstruction, calibration) converts the reconstruction
+	into Hounsfield Units using the water attenuation in calibration, and returns
+	the uint16 stored values (HU + 1024, limited to 0 to 4095) that create_dicom
+	writes with stored=True.
+
+	stored = hu_stored(reconstruction, calibration, out) writes the result into the
+	uint16 array out, which can be reused for every slice. The conversion is done
+	in a single float32 pass, rather than with separate offset, clip and cast copies."""
+
+	calibration = float(np.squeeze(calibration))
+
+	if out is None:
+		out = np.empty(reconstruction.shape, dtype=np.uint16)
+	elif out.dtype != np.uint16 or out.shape != reconstruction.shape:
+		raise ValueError('output array must be uint16 and the same shape as reconstruction')
+
+	# 1000 * (x - c) / c + 1024, with 0.5 added so that the cast rounds
+	work = np.multiply(reconstruction, 1000 / calibration, dtype=np.float32)
+	work += 1024 - 1000 + 0.5
+	np.clip(work, 0, 4095, out=work)
+	np.copyto(out, work, casting='unsafe')
 
-	return hounsfield
\ No newline at end of file
+	return out
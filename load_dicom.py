@@ -0,0 +1,113 @@
+import concurrent.futures
+import glob
+import os
+import struct
+import numpy as np
+import pydicom
+
+def load_dicom_series(storage_directory, filename=None, workers=None, stored=False, dtype=np.float32):
+
+	""" Load a DICOM series into a volume
+
+	volume = load_dicom_series(storage_directory, filename) reads the frames
+	filename_NNNN.dcm in storage_directory, as written by create_dicom or
+	create_dicom_series, into a volume (slices x rows x cols) of Hounsfield
+	Units, with the frames in order of slice location. If filename is not
+	given, every .dcm file in storage_directory is read.
+
+	The frames are read on a pool of workers threads (default chosen by
+	concurrent.futures). The headers are read first, without the pixel data,
+	to find the size and order of the frames, and then each frame's pixel
+	data is read straight into a buffer and used in place, and is rescaled
+	with its slope and intercept into the volume in a single step.
+
+	If stored is True, the volume instead holds the stored values, such as
+	uint16 HU + 1024, without rescaling. Otherwise the volume has type dtype.
+	Frames with compressed pixel data are decoded by pydicom.
+	"""
+
+	if filename is None:
+		files = glob.glob(os.path.join(storage_directory, '*.dcm'))
+	else:
+		files = glob.glob(os.path.join(storage_directory, glob.escape(filename) + '_*.dcm'))
+	if len(files) == 0:
+		raise ValueError('no DICOM files found in ' + storage_directory)
+
+	with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+
+		# read every header, and sort the frames by slice location
+		headers = list(pool.map(_read_header, files))
+		order = sorted(range(len(files)), key=lambda i: (headers[i]['location'], headers[i]['number'], files[i]))
+
+		rows, cols, pixel_dtype = headers[0]['rows'], headers[0]['cols'], headers[0]['dtype']
+		for header in headers:
+			if (header['rows'], header['cols']) != (rows, cols):
+				raise ValueError('DICOM frames have different sizes')
+		volume = np.empty((len(files), rows, cols), dtype=pixel_dtype if stored else dtype)
+
+		# read the pixel data of each frame into its place in the volume
+		def read_frame(index):
+			i = order[index]
+			_read_pixels(files[i], headers[i], volume[index], stored)
+		list(pool.map(read_frame, range(len(files))))
+
+	return volume
+
+def _read_header(full_filename):
+	"""the size, pixel type, rescale, slice location and pixel data position of a
+	DICOM file, read without its pixel data"""
+
+	with open(full_filename, 'rb') as f:
+		ds = pydicom.dcmread(f, stop_before_pixels=True)
+		position = f.tell()
+
+	if 'SliceLocation' in ds:
+		location = float(ds.SliceLocation)
+	elif 'ImagePositionPatient' in ds:
+		location = float(ds.ImagePositionPatient[2])
+	else:
+		location = 0.0
+
+	bits = int(ds.BitsAllocated)
+	pixel_dtype = np.dtype(('i' if int(ds.PixelRepresentation) == 1 else 'u') + str(bits // 8))
+
+	return {'rows': int(ds.Rows), 'cols': int(ds.Columns), 'dtype': pixel_dtype,
+		'slope': float(ds.get('RescaleSlope', 1)), 'intercept': float(ds.get('RescaleIntercept', 0)),
+		'location': location, 'number': int(ds.get('InstanceNumber', 0) or 0),
+		'implicit': ds.file_meta.TransferSyntaxUID == pydicom.uid.ImplicitVRLittleEndian,
+		'compressed': ds.file_meta.TransferSyntaxUID.is_compressed,
+		'big_endian': not ds.file_meta.TransferSyntaxUID.is_little_endian,
+		'position': position}
+
+def _read_pixels(full_filename, header, out, stored):
+	"""read the pixel data of a DICOM file into out (rows x cols), rescaled to
+	HU unless stored is True"""
+
+	if header['compressed'] or header['big_endian']:
+		# let pydicom decode anything but native little endian pixel data
+		pixels = pydicom.dcmread(full_filename).pixel_array
+	else:
+		with open(full_filename, 'rb') as f:
+			f.seek(header['position'])
+			element = f.read(12)
+
+			# skip the tag, and the VR for explicit VR files, to find the length
+			if header['implicit']:
+				length = struct.unpack('<I', element[4:8])[0]
+				f.seek(header['position'] + 8)
+			else:
+				length = struct.unpack('<I', element[8:12])[0]
+
+			count = header['rows'] * header['cols']
+			if length < count * header['dtype'].itemsize:
+				raise ValueError('pixel data of ' + full_filename + ' is too short')
+
+			buffer = bytearray(count * header['dtype'].itemsize)
+			f.readinto(buffer)
+		pixels = np.frombuffer(buffer, header['dtype']).reshape(out.shape)
+
+	if stored:
+		out[...] = pixels
+	else:
+		np.multiply(pixels, header['slope'], out=out, casting='unsafe')
+		out += header['intercept']
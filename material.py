@@ -57,4 +57,40 @@ class Material(object):
 
 		# return the appropriate coeff
 		index = self.name.index(input)
-		return self.coeffs[index]
\ No newline at end of file
+		return self.coeffs[index]
+
+	def segment(self, reconstruction, energy, materials=None, hu=False):
+		"""Given a reconstruction of attenuation coefficients at an effective
+		energy (in MeV), this returns the index of the closest material for each
+		value. The reconstruction can be of any shape, such as a single image or
+		a whole volume, and the output has the same shape.
+
+		materials can restrict the candidates to a list of material names, for
+		example the materials expected in a phantom. If hu is True, the
+		reconstruction is in Hounsfield Units instead of attenuation coefficients.
+
+		The candidate coefficients are sorted, and each value is classified by
+		finding it among the midpoints between them, so no temporary larger than
+		the reconstruction is needed."""
+
+		# get the candidate material indices
+		if materials is None:
+			indices = np.arange(len(self.name))
+		else:
+			for name in materials:
+				if name not in self.name:
+					raise IndexError('Material ' + name + ' not found. Acceptable materials include: ' + str(self.name))
+			indices = np.array([self.name.index(name) for name in materials])
+
+		# coefficients of each candidate at the given energy
+		mu = np.array([np.interp(energy, self.mev, self.coeffs[index]) for index in indices])
+		if hu:
+			water = np.interp(energy, self.mev, self.coeff('Water'))
+			mu = 1000 * (mu - water) / water
+
+		# sort the candidates and find the thresholds half way between them
+		order = np.argsort(mu, kind='stable')
+		mu = mu[order]
+		thresholds = (mu[1:] + mu[:-1]) / 2
+
+		return indices[order][np.searchsorted(thresholds, reconstruction)]
@@ -1,8 +1,8 @@
 import math
 import numpy as np
-from numpy.core.numeric import zeros_like
-import numpy.matlib
+from ct_memory import instrument
 
+@instrument('ramp_filter')
 def ramp_filter(sinogram, scale, alpha=0.001):
 	""" Ram-Lak filter with raised-cosine for CT reconstruction
 
@@ -10,11 +10,32 @@ def ramp_filter(sinogram, scale, alpha=0.001):
 	using a Ram-Lak filter.
 
 	fs = ramp_filter(sinogram, scale, alpha) can be used to modify the Ram-Lak filter by a
-	cosine raised to the power given by alpha."""
+	cosine raised to the power given by alpha.
+
+	A stack of sinograms (slices x angles x samples) is filtered all at once.
+	sinogram can also be a ChunkedArray from ct_lib, which is read once."""
+
+	sinogram = np.asarray(sinogram)
 
 	# get input dimensions
-	angles = sinogram.shape[0]
-	n = sinogram.shape[1]
+	angles = sinogram.shape[-2]
+	n = sinogram.shape[-1]
+
+	m, q = ramp_filter_response(n, scale, alpha)
+
+	# apply filter to all angles
+	print('Ramp filtering')
+	ft = np.fft.rfft(sinogram, m, axis=-1)
+	filtered = np.fft.irfft(ft * q, axis=-1)[..., :n]
+	
+	return filtered
+
+def ramp_filter_response(n, scale, alpha=0.001):
+	""" frequency response of the raised Ram-Lak filter
+
+	m, q = ramp_filter_response(n, scale, alpha) returns the FFT length m used to
+	filter n samples, at least twice as long, and the filter q at each of the
+	(m/2 + 1) positive frequencies of np.fft.rfft, as used by ramp_filter."""
 
 	#Set up filter to be at least twice as long as input
 	m = np.ceil(np.log(2*n-1) / np.log(2))
@@ -24,9 +45,4 @@ def ramp_filter(sinogram, scale, alpha=0.001):
 	q_k = lambda k, a : (np.where(k == 0, 1, 0) * np.cos(math.pi / m) ** a / 6 + np.abs(k) * np.cos((math.pi * k) / m) ** a) / (m * scale)
 	q = q_k(np.arange(m//2 + 1), alpha)
 
-	# apply filter to all angles
-	print('Ramp filtering')
-	ft = np.fft.rfft(sinogram, m, axis=1)
-	filtered = np.fft.irfft(ft * q, axis= 1)[:, :n]
-	
-	return filtered
\ No newline at end of file
+	return m, q
@@ -5,21 +5,47 @@ from ramp_filter import *
 from back_project import *
 from hu import *
 
-def scan_and_reconstruct(photons, material, phantom, scale, angles, mas=10000, alpha=0.001, correct=True):
+def scan_and_reconstruct(photons, material, phantom, scale, angles, mas=10000, alpha=0.001, correct=True, stored=False, back_projection='direct', attenuation=False):
 
 	""" Simulation of the CT scanning process
 		reconstruction = scan_and_reconstruct(photons, material, phantom, scale, angles, mas, alpha)
 		takes the phantom data in phantom (samples x samples), scans it using the
 		source photons and material information given, as well as the scale (in cm),
 		number of angles, time-current product in mas, and raised-cosine power
-		alpha for filtering. The output reconstruction is the same size as phantom."""
+		alpha for filtering. The output reconstruction is the same size as phantom.
+
+		If stored is True, the output is instead the uint16 DICOM stored values
+		from hu_stored, ready to be written by create_dicom with stored=True.
+		If attenuation is True, the output is the reconstructed attenuation,
+		before conversion to Hounsfield Units, as needed by mtf.
+
+		back_projection selects the back_project method, 'direct' or the faster,
+		approximate 'hierarchical'.
+
+		photons can also be several source spectra (spectra x energies), such as
+		a list of spectra or from fake_sources, with mas a single value or one for
+		each spectrum. The phantom is then scanned once for all the spectra, as
+		by ct_scan, and the output is a reconstruction for each spectrum (spectra
+		x samples x samples)."""
 
 
 	# convert source (photons per (mas, cm^2)) to photons
 
 	# create sinogram from phantom data, with received detector values
+	if isinstance(photons, (list, tuple)):
+		photons = np.array(photons)
 	sinogram = ct_scan(photons, material, phantom, scale, angles, mas)
 
+	# reconstruct the scan with each spectrum in turn
+	if photons.ndim == 2:
+		return np.stack([_reconstruct(photons[index], material, sinogram[index], scale, alpha, correct, stored, back_projection, attenuation)
+			for index in range(len(photons))])
+
+	return _reconstruct(photons, material, sinogram, scale, alpha, correct, stored, back_projection, attenuation)
+
+def _reconstruct(photons, material, sinogram, scale, alpha, correct, stored, back_projection, attenuation):
+	"""reconstruction from the detections in sinogram, as in scan_and_reconstruct"""
+
 	# convert detector values into calibrated attenuation values
 	sinogram = ct_calibrate(photons, material, sinogram, scale, correct)
 
@@ -27,9 +53,54 @@ def scan_and_reconstruct(photons, material, phantom, scale, angles, mas=10000, a
 	sinogram = ramp_filter(sinogram, scale, alpha)
 
 	# Back-projection
-	reconstruction = back_project(sinogram)
+	reconstruction = back_project(sinogram, method=back_projection)
 
 	# convert to Hounsfield Units
-	reconstruction = hu(photons, material, reconstruction, scale)
+	if attenuation:
+		return reconstruction
+	elif stored:
+		calibration = hu_calibration(photons, material, scale, max(reconstruction.shape))
+		reconstruction = hu_stored(reconstruction, calibration)
+	else:
+		reconstruction = hu(photons, material, reconstruction, scale)
+
+	return reconstruction
+
+def scan_and_reconstruct_volume(photons, material, phantoms, scale, angles, storage_directory, file_name, mas=10000, alpha=0.001, correct=True, back_projection='direct'):
+
+	""" Simulation of the CT scanning process for a volume
+		volume, done = scan_and_reconstruct_volume(photons, material, phantoms, scale, angles,
+		storage_directory, file_name) scans and reconstructs each slice of phantoms
+		(slices x samples x samples) as scan_and_reconstruct does, writing the DICOM
+		stored values into a disk-backed, memory-mapped volume from open_volume,
+		so only a slice at a time is held in memory. phantoms can itself be a
+		memory-mapped array. done flags the slices which are complete.
+
+		Each slice is flushed to disk before it is flagged, so running this again
+		after it was stopped carries on from the first incomplete slice. The
+		volume can then be written as DICOM with create_dicom_series. back_projection
+		is as for scan_and_reconstruct."""
+
+	slices = len(phantoms)
+	n = max(phantoms[0].shape)
+	volume, done = open_volume(storage_directory, file_name, (slices, n, n), metadata={'scale': scale, 'angles': angles,
+		'mas': mas, 'alpha': alpha, 'correct': correct, 'back_projection': back_projection})
+
+	# the water calibration is the same for every slice
+	calibration = hu_calibration(photons, material, scale, n)
+
+	for index in range(slices):
+		if done[index]:
+			continue
+
+		sinogram = ct_scan(photons, material, np.asarray(phantoms[index]), scale, angles, mas)
+		sinogram = ct_calibrate(photons, material, sinogram, scale, correct)
+		sinogram = ramp_filter(sinogram, scale, alpha)
+		reconstruction = back_project(sinogram, method=back_projection)
+
+		hu_stored(reconstruction, calibration, volume[index])
+		volume.flush()
+		done[index] = True
+		done.flush()
 
-	return reconstruction
\ No newline at end of file
+	return volume, done
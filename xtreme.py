@@ -4,9 +4,14 @@ from scipy import ndimage
 import math
 import os
 import sys
+import time as timer
 from ramp_filter import *
 from back_project import *
 from create_dicom import *
+from hu import hu_stored
+from ct_kernels import get_backend, bilinear
+from ct_memory import instrument
+from ct_lib import open_chunked_array, open_volume, open_manifest, update_manifest, WorkQueue
 
 class Xtreme(object):
     def __init__(self, file):
@@ -99,6 +104,23 @@ class Xtreme(object):
 
             f.close()
 
+        # no reordered cache until create_cache is used
+        self.slice_cache = None
+        self.angle_cache = None
+        self.dark_cache = None
+        self.flat_cache = None
+
+        # fan to parallel coordinates, found when first needed
+        self._parallel = None
+
+        # back_project method used by every reconstruction, 'direct' or the
+        # faster, approximate 'hierarchical'
+        self.back_projection = 'direct'
+
+        # reconstructed attenuation of water, for conversion to Hounsfield units
+        self.calibration = 23.835e-3
+
+    @instrument('xtreme.get_rsq_scan')
     def get_rsq_scan(self, angle):
 
         """ [Y, Ymin, Ymax] = get_rsq_scan( A ) reads in angle A from the file.
@@ -117,6 +139,11 @@ class Xtreme(object):
             print('Angle is not within range')
             return
 
+        # read contiguous blocks from the angle-major cache, if there is one
+        if self.angle_cache is not None:
+            Y = self.angle_cache[angle].astype(float)
+            return Y, self.dark_cache[:].astype(float), self.flat_cache[:].astype(float)
+
         # open file and get to start of data
         f = open(self.filename, 'rb')
         f.seek((self.data_offset+1)*512,0)
@@ -143,6 +170,7 @@ class Xtreme(object):
 
         return Y, Ymin, Ymax
 
+    @instrument('xtreme.get_rsq_slice')
     def get_rsq_slice(self, scan):
 
         """ [Y, Ymin, Ymax] = get_rsq_slice( F ) reads in slice F from the file.
@@ -160,6 +188,11 @@ class Xtreme(object):
             print('Scan is not within range')
             return
 
+        # read contiguous blocks from the slice-major cache, if there is one
+        if self.slice_cache is not None:
+            Y = self.slice_cache[scan].astype(float)
+            return Y, self.dark_cache[scan], self.flat_cache[scan]
+
         # open file and get to start of data
         f = open(self.filename, 'rb')
         f.seek((self.data_offset+1)*512,0)
@@ -186,14 +219,223 @@ class Xtreme(object):
 
         return Y, Ymin, Ymax
 
+    @instrument('xtreme.get_rsq_fan')
+    def get_rsq_fan(self, fan):
+
+        """ [Y, Ymin, Ymax, SCANS] = get_rsq_fan( FAN ) reads in every slice of
+        the z-fan starting at scan FAN which reconstruct_all uses, excluding the
+        scans that overlap with the neighbouring z-fans.
+
+        The returned data Y is a stack of fan-based sinograms of size (slices x
+        angles x samples), Ymin and Ymax are the matching (slices x samples)
+        noise floor and reference detections, and SCANS are the slice numbers."""
+
+        if not self.okay:
+            print('File not opened correctly')
+            return
+
+        scans = np.arange(fan + self.skip_scans, min(fan + self.fan_scans - self.skip_scans, self.scans))
+        if len(scans) == 0:
+            empty = np.zeros((0, self.samples), dtype=np.int16)
+            return np.zeros((0, self.angles, self.samples)), empty, empty, scans
+
+        if self.slice_cache is not None:
+            Y = self.slice_cache[scans[0]:scans[-1] + 1].astype(float)
+            return Y, self.dark_cache[scans[0]:scans[-1] + 1], self.flat_cache[scans[0]:scans[-1] + 1], scans
+
+        # the RSQ data is (scans x (angles + 2) x all samples), with the
+        # calibration rows first in each scan, and the slices are contiguous
+        raw = np.memmap(self.filename, dtype=np.int16, mode='r', offset=(self.data_offset+1)*512,
+            shape=(self.scans, self.angles + 2, self.samples + self.skip_samples))
+        data = np.array(raw[scans[0]:scans[-1] + 1, :, self.left_samples:self.left_samples + self.samples])
+        del raw
+
+        return data[:, 2:].astype(float), data[:, 0], data[:, 1], scans
+
+    def reconstruct_fan(self, fan, alpha=None):
+
+        """ [R, SCANS] = reconstruct_fan( FAN, ALPHA ) reconstructs every slice
+        of the z-fan starting at scan FAN, as in reconstruct_all, with each
+        stage applied to the whole (slices x angles x samples) stack at once.
+        R is the reconstructed attenuation (slices x samples x samples) and
+        SCANS are the slice numbers."""
+
+        if alpha is None:
+            alpha = 0.001
+
+        # get scan detector values, noise floor and reference
+        sinogram, noise, ref, scans = self.get_rsq_fan(fan)
+
+        # calibrate, convert from fan to parallel, filter and back project
+        sinogram = self._filter(sinogram, noise[:, None, :], ref[:, None, :], alpha)
+        reconstruction = back_project(sinogram, method=self.back_projection)
+
+        return reconstruction, scans
+
+    def reconstruct_slice(self, scan, alpha=None, stored=None):
+
+        """ R = reconstruct_slice( F, ALPHA ) reconstructs slice F, as in
+        reconstruct_all, returning the reconstructed attenuation R (samples x
+        samples). ALPHA is the power of the raised cosine function used to
+        filter the data.
+
+        R = reconstruct_slice( F, ALPHA, STORED ) instead converts R to Hounsfield
+        units, as DICOM stored values, with hu_stored, writing them into the
+        uint16 array STORED, which is returned. STORED can be a slice of a
+        volume, or a buffer reused for every slice."""
+
+        if alpha is None:
+            alpha = 0.001
+
+        # get scan detector values, noise floor and reference
+        sinogram, noise, ref = self.get_rsq_slice(scan)
+
+        # calibrate, convert from fan to parallel, filter and back project
+        sinogram = self._filter(sinogram, noise, ref, alpha)
+        reconstruction = back_project(sinogram, method=self.back_projection)
+
+        if stored is None:
+            return reconstruction
+
+        return hu_stored(reconstruction, self.calibration, stored)
+
+    def _filter(self, sinogram, noise, ref, alpha):
+
+        """ filtered parallel-beam sinogram (or stack of them) from the detector
+        values of a fan sinogram, with its noise floor and reference, which are
+        converted to calibrated attenuation values, converted from fan to
+        parallel and ramp filtered"""
+
+        # convert detector values into calibrated attenuation values
+        noise = np.asarray(noise, dtype=float)
+        sinogram = - np.log((sinogram - noise) / (ref - noise))
+
+        # convert scan from fan to parallel, and apply Ram-Lak filter
+        sinogram = self.fan_to_parallel(sinogram)
+
+        return ramp_filter(sinogram, self.scale, alpha)
+
+    def create_cache(self, storage_directory, layout='slice'):
+
+        """ create_cache( DIRECTORY, LAYOUT ) converts the RSQ file, once, into
+        a local cache in DIRECTORY, which get_rsq_slice and get_rsq_scan then
+        read instead of the RSQ file. LAYOUT is the access pattern to store for:
+
+        'slice' - slice-major sinograms (scans x angles x samples), for
+                  get_rsq_slice and reconstruct_all
+        'angle' - angle-major projection views (angles x scans x samples), for
+                  get_rsq_scan
+
+        The noise floor and reference calibration rows are split out into
+        separate (scans x samples) arrays. The cache is stored uncompressed, as
+        ChunkedArrays from ct_lib, so each slice or view is one contiguous,
+        memory-mapped block. An existing cache is reused if it was made from the
+        same RSQ file, unchanged since."""
+
+        if not self.okay:
+            print('File not opened correctly')
+            return
+
+        if layout not in ('slice', 'angle'):
+            raise ValueError('layout must be slice or angle')
+
+        # identify the RSQ file, so an out of date cache is not used
+        stat = os.stat(self.filename)
+        source = {'filename': os.path.abspath(self.filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
+        name = os.path.splitext(os.path.basename(self.filename))[0]
+
+        caches = []
+        for part in (layout, 'dark', 'flat'):
+            try:
+                cache = open_chunked_array(storage_directory, name + '_' + part)
+                if cache.metadata.get('source') != source:
+                    cache = None
+            except Exception:
+                cache = None
+            caches.append(cache)
+
+        if None in caches:
+            print('Creating ' + layout + ' cache for ' + self.filename)
+
+            # the RSQ data is (scans x (angles + 2) x all samples), with the
+            # calibration rows first in each scan
+            raw = np.memmap(self.filename, dtype=np.int16, mode='r', offset=(self.data_offset+1)*512,
+                shape=(self.scans, self.angles + 2, self.samples + self.skip_samples))
+            valid = slice(self.left_samples, self.left_samples + self.samples)
+
+            metadata = {'source': source, 'layout': layout}
+            if layout == 'slice':
+                shape, chunks = (self.scans, self.angles, self.samples), (1, self.angles, self.samples)
+            else:
+                shape, chunks = (self.angles, self.scans, self.samples), (1, self.scans, self.samples)
+            data = open_chunked_array(storage_directory, name + '_' + layout, 'w', shape, np.int16, chunks, 0, metadata)
+            dark = open_chunked_array(storage_directory, name + '_dark', 'w', (self.scans, self.samples), np.int16, None, 0, metadata)
+            flat = open_chunked_array(storage_directory, name + '_flat', 'w', (self.scans, self.samples), np.int16, None, 0, metadata)
+
+            # calibration rows for every scan
+            calibration = np.array(raw[:, 0:2, valid])
+            dark[:] = calibration[:, 0]
+            flat[:] = calibration[:, 1]
+
+            # read through the file once, in blocks of whole chunks of the
+            # cache: scans for slice-major, angles for angle-major
+            if layout == 'slice':
+                block = max(1, 2 ** 26 // raw[0].nbytes)
+                for start in range(0, self.scans, block):
+                    stop = min(start + block, self.scans)
+                    data[start:stop] = raw[start:stop, 2:, valid]
+            else:
+                block = max(1, 2 ** 26 // raw[:, 0].nbytes)
+                for start in range(0, self.angles, block):
+                    stop = min(start + block, self.angles)
+                    data[start:stop] = np.array(raw[:, 2 + start:2 + stop, valid]).transpose(1, 0, 2)
+
+            for cache in (data, dark, flat):
+                cache.flush()
+            del raw
+
+            caches = [open_chunked_array(storage_directory, name + '_' + part) for part in (layout, 'dark', 'flat')]
+
+        if layout == 'slice':
+            self.slice_cache = caches[0]
+        else:
+            self.angle_cache = caches[0]
+        self.dark_cache, self.flat_cache = caches[1], caches[2]
+
     def fan_to_parallel(self, X):
 
         """ Y = fan_to_parallel( X ) takes the raw sinogram in X (angles x
         samples) and converts this to an equivalent parallel-beam sinogram
-        in Y (recon_angles x samples)."""
+        in Y (recon_angles x samples).
+
+        X can also be a stack of sinograms (slices x angles x samples), which
+        are all converted at once using the same interpolation taps, or by
+        the compiled kernel when the ct_kernels backend is numba."""
 
         print('Fan to parallel sinogram')
-        
+
+        yo, xo = self.parallel_coordinates()
+
+        # actually perform the interpolation
+        if get_backend() == 'numba':
+            Y = bilinear(X, yo, xo)
+        elif X.ndim == 2:
+            Y = scipy.ndimage.map_coordinates(X, [yo, xo], None, 1, 'constant', 0, False)
+        else:
+            Y = self._interpolate_stack(X, yo, xo)
+
+        return Y
+
+    def parallel_coordinates(self):
+
+        """ [YO, XO] = parallel_coordinates() returns the (angle, sample)
+        positions in the raw fan sinogram of each (recon_angles x samples)
+        point of the parallel-beam sinogram. These only depend on the scanner
+        geometry, so are found once and kept."""
+
+        if self._parallel is not None:
+            return self._parallel
+
         # calculate some required parameters
         angles = self.recon_angles
         samples = self.samples
@@ -230,15 +472,242 @@ class Xtreme(object):
         # adjust angle so it is not zero-based
         yo = yo/self.dtheta + yo1 + self.skip_angles/2.0 + self.fan_angles/2.0 - 0.5
 
-        # actually perform the interpolation
-        Y = scipy.ndimage.map_coordinates(X, [yo, xo], None, 1, 'constant', 0, False)
+        self._parallel = (yo, xo)
 
-        return Y
+        return self._parallel
+
+    def _interpolate_stack(self, X, yo, xo):
+
+        """ bilinear interpolation of every (angles x samples) sinogram in the
+        stack X at (yo, xo), with zero outside, as for map_coordinates"""
+
+        angles, samples = X.shape[-2], X.shape[-1]
+        valid = (yo >= 0) & (yo <= angles - 1) & (xo >= 0) & (xo <= samples - 1)
+        y0 = np.clip(np.floor(yo).astype(int), 0, angles - 2)
+        x0 = np.clip(np.floor(xo).astype(int), 0, samples - 2)
+        fy, fx = yo - y0, xo - x0
+
+        Y = (X[:, y0, x0] * ((1 - fy) * (1 - fx)) + X[:, y0, x0 + 1] * ((1 - fy) * fx)
+            + X[:, y0 + 1, x0] * (fy * (1 - fx)) + X[:, y0 + 1, x0 + 1] * (fy * fx))
+
+        return np.where(valid, Y, 0)
+
+    def reconstruct_preview(self, scan, alpha=None, levels=4):
+
+        """ for Y in reconstruct_preview( F, ALPHA ) yields successively finer
+        reconstructions of slice F, using back_project_progressive, so a coarse
+        image is available almost at once and is refined to the full
+        reconstruction (in attenuation, not Hounsfield units). ALPHA is the power
+        of the raised cosine function used to filter the data."""
+
+        if alpha is None:
+            alpha = 0.001
+
+        # get scan detector values, noise floor and reference
+        sinogram, noise, ref = self.get_rsq_slice(scan)
+
+        yield from back_project_progressive(self._filter(sinogram, noise, ref, alpha), levels)
+
+
+
+
+    def reconstruct_stream(self, scans, alpha=None, every=None):
+
+        """ for Y in reconstruct_stream( S, ALPHA, EVERY ) reads the views one
+        angle at a time with get_rsq_scan, as they were acquired, and yields
+        the running reconstruction (in attenuation, not Hounsfield units) of
+        each slice in the list S after every EVERY views (default an eighth of
+        the views, so 8 updates in all), and finally the full reconstruction.
+        ALPHA is the power of the raised cosine function used to filter the
+        data.
+
+        Each update is a new (slices x samples x samples) array, scaled and
+        masked from the running sum, so it costs a pass over, and the memory
+        of, the whole reconstruction, about as much as back-projecting another
+        parallel-beam angle. EVERY as small as one parallel-beam angle's worth
+        of views (angles // recon_angles) gives the most updates, one per
+        angle, which roughly doubles the time spent back-projecting.
+
+        Each parallel-beam angle is formed, as for fan_to_parallel, as soon as
+        the views it needs have been read, and is filtered and back-projected
+        straight away with a BackProjector, so only the reconstructions and
+        the window of views spanned by one parallel-beam angle are held."""
+
+        if alpha is None:
+            alpha = 0.001
+
+        scans = np.asarray(scans, dtype=int)
+        yo, xo = self.parallel_coordinates()
+        angles = self.recon_angles
+        if every is None:
+            every = max(self.angles // 8, 1)
+
+        # window of views, from angle first, needed by each parallel-beam angle
+        low = np.clip(np.floor(yo.min(axis=1)).astype(int), 0, self.angles - 2)
+        high = np.clip(np.floor(yo.max(axis=1)).astype(int) + 1, low + 1, self.angles - 1)
+
+        projector = BackProjector(self.samples, angles, self.scale, alpha, (len(scans),))
+        window = {}
+        row = 0
+        for angle in range(self.angles):
 
+            # get the detector values for these scans, and calibrate them
+            Y, Ymin, Ymax = self.get_rsq_scan(angle)
+            noise = Ymin[scans]
+            window[angle] = - np.log((Y[scans] - noise) / (Ymax[scans] - noise))
 
+            # add every parallel-beam angle which now has all its views
+            while row < angles and high[row] <= angle:
+                X = np.stack([window[a] for a in range(low[row], high[row] + 1)], axis=1)
+                projector.add(row, self._interpolate_stack(X, yo[row] - low[row], xo[row]))
+                row = row + 1
+                for a in [a for a in window if row >= angles or a < low[row]]:
+                    del window[a]
 
+            if (angle + 1) % every == 0 and row < angles:
+                yield projector.image()
 
-    def reconstruct_all(self, file, method=None, alpha=None):
+        yield projector.image()
+
+    def frame_scans(self):
+
+        """ S = frame_scans() returns the scan number of each frame written by
+        reconstruct_all, in order, leaving out the scans which overlap with the
+        neighbouring z-fans."""
+
+        scans = []
+        for fan in range(0, self.scans, self.fan_scans):
+            for scan in range(fan+self.skip_scans,fan+self.fan_scans-self.skip_scans):
+                if (scan<self.scans):
+                    scans.append(scan)
+
+        return np.array(scans, dtype=int)
+
+    def reconstruct_volume(self, storage_directory, file_name, alpha=None):
+
+        """ [V, DONE] = reconstruct_volume( DIRECTORY, FILENAME, ALPHA ) reconstructs
+        every frame of reconstruct_all into a disk-backed, memory-mapped volume V
+        (frames x samples x samples) of DICOM stored values, from open_volume in
+        ct_lib, one slice at a time, so memory use does not grow with the number of
+        frames. DONE flags the frames which are complete.
+
+        Each frame is flushed to disk before it is flagged, so if this is stopped
+        and run again, it carries on from the first incomplete frame. The volume
+        can then be written as DICOM in a separate pass with create_dicom_series."""
+
+        if alpha is None:
+            alpha = 0.001
+
+        scans = self.frame_scans()
+        volume, done = open_volume(storage_directory, file_name, (len(scans), self.samples, self.samples),
+            metadata={'rsq': os.path.basename(self.filename), 'alpha': alpha, 'method': self.back_projection,
+            'calibration': self.calibration})
+
+        for z, scan in enumerate(scans):
+            if done[z]:
+                continue
+
+            sys.stdout.write("Frame: " + str(z + 1) + ' of ' + str(len(scans)) + '\n')
+
+            # reconstruct in Hounsfield units, straight into the volume
+            self.reconstruct_slice(scan, alpha, volume[z])
+            volume.flush()
+            done[z] = True
+            done.flush()
+
+        return volume, done
+
+    def reconstruct_checkpointed(self, storage_directory, file, alpha=None, worker=None, timeout=600, wait=None):
+
+        """ F = reconstruct_checkpointed( DIRECTORY, FILENAME, ALPHA ) creates the
+        same DICOM series as reconstruct_all( FILENAME, ALPHA ), in DIRECTORY,
+        but can be stopped and run again, and can be run by several processes at
+        once, on one machine or on several sharing DIRECTORY. F lists the frame
+        numbers which are complete.
+
+        The study, series and frame UIDs and the time of the series are kept in a
+        manifest, FILENAME.json, from open_manifest in ct_lib, which is created by
+        the first process and reused by every later one, so all the frames belong
+        to one series. Frames are shared out with a WorkQueue from ct_lib, so each
+        is reconstructed once. A frame is only marked as done once its DICOM file
+        is written, and the manifest is updated with the completed frames after
+        each one. A run which is restarted skips the completed frames.
+
+        WORKER names this process in the queue, and TIMEOUT is the time in
+        seconds after which a frame claimed by a process which has stopped is
+        reconstructed by another, as described for WorkQueue. Running again with
+        the same stable WORKER name carries straight on with its own frames.
+
+        Once every frame has been claimed, this keeps checking the frames held
+        by other processes, taking over any which go stale, until every frame
+        is complete. If no frame is completed by any process for WAIT seconds
+        (default twice TIMEOUT, or at once if TIMEOUT is None, as stale claims
+        are then never taken over), a ValueError listing the pending frames is
+        raised."""
+
+        if alpha is None:
+            alpha = 0.001
+
+        scans = self.frame_scans()
+        manifest = open_manifest(storage_directory, file, {'rsq': os.path.basename(self.filename), 'frames': len(scans),
+            'samples': self.samples, 'alpha': alpha, 'method': self.back_projection, 'study_uid': pydicom.uid.generate_uid(),
+            'series_uid': pydicom.uid.generate_uid(), 'frame_uid': pydicom.uid.generate_uid(),
+            'time': datetime.datetime.now().isoformat(), 'completed': []})
+        if (manifest['frames'] != len(scans) or manifest['samples'] != self.samples or manifest['alpha'] != alpha
+            or manifest.get('method', 'direct') != self.back_projection):
+            raise ValueError('manifest ' + file + '.json is for a different dataset, alpha or method')
+
+        if wait is None:
+            wait = 0 if timeout is None else 2 * timeout
+
+        queue = WorkQueue(storage_directory, file, worker, timeout)
+        try:
+            # claim frames until all are done, waiting for the other processes
+            completed = None
+            while True:
+                self._reconstruct_frames(queue, scans, storage_directory, file, alpha, manifest)
+                pending = [z for z in range(1, len(scans) + 1) if not queue.is_done(z)]
+                if len(pending) == 0:
+                    break
+                if queue.completed() != completed:
+                    completed = queue.completed()
+                    since = timer.monotonic()
+                elif timer.monotonic() - since >= wait:
+                    raise ValueError('frames ' + str(pending) + ' of ' + file + ' are still pending after waiting '
+                        + str(wait) + ' seconds for the processes which claimed them')
+                timer.sleep(1 if timeout is None else min(timeout / 4, 10))
+        finally:
+            queue.close()
+
+        manifest['completed'] = queue.completed()
+        update_manifest(storage_directory, file, manifest)
+
+        return manifest['completed']
+
+    def _reconstruct_frames(self, queue, scans, storage_directory, file, alpha, manifest):
+        """reconstruct each frame claimed from queue, for reconstruct_checkpointed"""
+
+        time = datetime.datetime.fromisoformat(manifest['time'])
+
+        # reused output buffer
+        stored = np.empty((self.samples, self.samples), dtype=np.uint16)
+
+        for z, scan in enumerate(scans, 1):
+            if not queue.claim(z):
+                continue
+
+            sys.stdout.write("Frame: " + str(z) + ' of ' + str(len(scans)) + '\n')
+
+            # reconstruct in Hounsfield units, as DICOM stored values, and save
+            self.reconstruct_slice(scan, alpha, stored)
+            create_dicom(stored, file, self.scale, self.scale, z, manifest['study_uid'], manifest['series_uid'],
+                manifest['frame_uid'], time, storage_directory, stored=True)
+
+            queue.finish(z)
+            manifest['completed'] = queue.completed()
+            update_manifest(storage_directory, file, manifest)
+
+    def reconstruct_all(self, file, method=None, alpha=None, volume=None, batch=False, writer=None):
         
         """ reconstruct_all( FILENAME, ALPHA ) creates a series of DICOM
         files for the Xtreme RSQ data. FILENAME is the base file name for
@@ -249,7 +718,22 @@ class Xtreme(object):
         specify how the data is reconstructed. Possible options are:
         'parallel' - reconstruct each slice separately using a fan to parallel
                            conversion
-        'fdk' - approximate FDK algorithm for better reconstruction"""
+        'fdk' - approximate FDK algorithm for better reconstruction
+
+        reconstruct_all( FILENAME, ALPHA, METHOD, VOLUME ) also writes each
+        reconstructed slice, as DICOM stored values, into VOLUME[z-1] for frame z.
+        VOLUME can be a ChunkedArray from ct_lib, of size (frames x samples x
+        samples), so the whole dataset can be read back in part later.
+
+        reconstruct_all( FILENAME, ALPHA, METHOD, VOLUME, BATCH ) with BATCH
+        True reconstructs each z-fan at once with reconstruct_fan, rather than
+        one slice at a time, which avoids per-slice overhead.
+
+        reconstruct_all( FILENAME, ALPHA, METHOD, VOLUME, BATCH, WRITER ) writes
+        the DICOM files through WRITER, a DicomWriter from create_dicom, so they
+        are written (and compressed, if it was made with compress=True) by
+        background processes while the next slices are reconstructed. WRITER
+        is left open, and its close() waits for the last frames."""
                 
         if alpha is None:
             alpha = 0.001
@@ -264,12 +748,36 @@ class Xtreme(object):
         frameuid = pydicom.uid.generate_uid()
         time = datetime.datetime.now()
 
+        # reused output buffer
+        stored = np.empty((self.samples, self.samples), dtype=np.uint16)
+
+        # write frames directly, or queue them with the background writer
+        save = create_dicom if writer is None else writer.write
+
         # main loop over each z-fan
         for fan in range(0, self.scans, self.fan_scans):
             if method == 'fdk':
                 
                 # correct reconstruction using FDK method, self.fan_scans scans at a time
                 pass
+
+            elif batch:
+
+                # reconstruct every slice of this z-fan at once
+                sys.stdout.write("Fan:  " + str(fan // self.fan_scans + 1) + '\n')
+                reconstructions, scans = self.reconstruct_fan(fan, alpha)
+
+                for reconstruction in reconstructions:
+
+                    # convert to Hounsfield units, as DICOM stored values
+                    hu_stored(reconstruction, self.calibration, stored)
+                    if volume is not None:
+                        volume[z - 1] = stored
+
+                    # save as dicom file
+                    save(stored, file, self.scale, self.scale, z, studyuid, seriesuid, frameuid, time, stored=True)
+
+                    z = z + 1
             
             else:
 
@@ -281,29 +789,18 @@ class Xtreme(object):
                         sys.stdout.write('\x1b[2K\x1b[1A\x1b[2K\x1b[1A\x1b[2K\x1b[1A\x1b[2K\x1b[1A\x1b[1A' + "Fan:  " + str(fan // self.fan_scans + 1) + '\n')
                         sys.stdout.write("Scan: " + str((scan - self.skip_scans) % self.fan_scans + 1) + '\n')
                         
-                        # get scan detector values, noise floor and reference
-                        sinogram, noise, ref = self.get_rsq_slice(scan)
-
-                        # convert detector values into calibrated attenuation values
-                        sinogram = - np.log((sinogram - noise) / (ref - noise))
-
-                        # convert scan from fan to parallel
-                        sinogram = self.fan_to_parallel(sinogram)
-
-                        # apply Ram-Lak filter
-                        sinogram = ramp_filter(sinogram, self.scale, alpha)
+                        # reconstruct in Hounsfield units, as DICOM stored values
+                        self.reconstruct_slice(scan, alpha, stored)
+                        if volume is not None:
+                            volume[z - 1] = stored
 
-                        # back project 
-                        reconstruction = back_project(sinogram)
-
-                        # convert to Hounsfield units
-                        reconstruction = 1000 * (reconstruction - 23.835e-3) / 23.835e-3
-                        reconstruction = reconstruction.clip(min=-1024, max=3071)
-
-						# save as dicom file
-                        create_dicom(reconstruction, file, self.scale, self.scale, z, studyuid, seriesuid, frameuid, time)
+                        # save as dicom file
+                        save(stored, file, self.scale, self.scale, z, studyuid, seriesuid, frameuid, time, stored=True)
 
                         z = z + 1
 
+        if hasattr(volume, 'flush'):
+            volume.flush()
+
         return
 